@@ -0,0 +1,367 @@
+#!/usr/bin/python3
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from ctgrzr.src.cli import cli, get_arg_parser
+from ctgrzr.src.ctgrzr_config import (
+    compact_config,
+    get_config_cache_path,
+    get_config_journal_path,
+    load_config,
+)
+from ctgrzr.src.logger import set_logging_level
+from ctgrzr.src.utils import dump_yaml
+
+BENCH_RESULTS_VERSION = 1
+
+
+def noop_operation(paths):
+    return 0
+
+
+def get_category(index):
+    return f"category{index}"
+
+
+def generate_config(config_path, size, categories):
+    # Paths don't exist, only (de)serialization & bookkeeping are measured
+    config = {get_category(i): [] for i in range(categories)}
+    for i in range(size):
+        config[get_category(i % categories)].append(
+            f"/synthetic/{i % 997}/{i // 997}/entry-{i}"
+        )
+    with open(config_path, "w") as f:
+        f.write(dump_yaml(config))
+
+
+def generate_tree(root, *, fanout, depth, files, symlink_density, rng):
+    file_paths = []
+    directories = [root]
+    for level in range(depth + 1):
+        next_directories = []
+        for directory in directories:
+            directory.mkdir(parents=True, exist_ok=True)
+            for i in range(files):
+                file_path = directory / f"file-{i}.txt"
+                file_path.write_text(str(i))
+                file_paths.append(file_path)
+                if rng.random() < symlink_density:
+                    (directory / f"symlink-{i}").symlink_to(rng.choice(file_paths))
+            if level < depth:
+                next_directories += [directory / f"dir-{i}" for i in range(fanout)]
+        directories = next_directories
+    return file_paths
+
+
+def write_tree_config(config_path, tree_root, file_paths, categories):
+    config = {get_category(i): [] for i in range(categories)}
+    for i, file_path in enumerate(file_paths):
+        config[get_category(i % categories)].append(str(file_path))
+    # Top-level directories give search-symlinks something to walk
+    config[get_category(0)] += [
+        str(path) for path in sorted(tree_root.iterdir()) if path.is_dir()
+    ]
+    with open(config_path, "w") as f:
+        f.write(dump_yaml(config))
+
+
+def write_operations(operations_path, categories, operation):
+    with open(operations_path, "w") as f:
+        f.write(dump_yaml({get_category(i): operation for i in range(categories)}))
+
+
+def remove_config_files(config_path):
+    for path in [
+        get_config_cache_path(config_path),
+        get_config_journal_path(config_path),
+    ]:
+        path.unlink(missing_ok=True)
+
+
+def run_cli(config_path, *arguments):
+    args = get_arg_parser().parse_args(["-c", str(config_path), *arguments])
+    # Commands printing per path would measure the terminal otherwise
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        return cli(args)
+
+
+def measure(name, function, *, repeat, setup=None, **labels):
+    timings = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    result = {
+        "name": name,
+        **labels,
+        "repeat": repeat,
+        "min": min(timings),
+        "mean": statistics.mean(timings),
+    }
+    print(
+        f'{name:<32} {" ".join(f"{k}={v}" for k, v in labels.items()):<24} '
+        + f'min {result["min"]:.4f}s mean {result["mean"]:.4f}s',
+        file=sys.stderr,
+    )
+    return result
+
+
+def bench_config(work_path, size, *, categories, repeat):
+    config_path = work_path / f"config-{size}.yaml"
+    generate_config(config_path, size, categories)
+    results = []
+    results.append(
+        measure(
+            "load_config_cold",
+            lambda: load_config(config_path),
+            setup=lambda: remove_config_files(config_path),
+            repeat=repeat,
+            size=size,
+        )
+    )
+    load_config(config_path)
+    results.append(
+        measure(
+            "load_config_cached",
+            lambda: load_config(config_path),
+            repeat=repeat,
+            size=size,
+        )
+    )
+    config = load_config(config_path)
+    results.append(
+        measure(
+            "save_config_compact",
+            lambda: compact_config(config_path, config),
+            repeat=repeat,
+            size=size,
+        )
+    )
+    # Every run adds another file, each one is appended to the journal
+    add_paths = [work_path / f"add-{size}-{i}" for i in range(repeat)]
+    for add_path in add_paths:
+        add_path.touch()
+    add_paths = iter(add_paths)
+    results.append(
+        measure(
+            "add",
+            lambda: run_cli(config_path, "add", str(next(add_paths)), get_category(0)),
+            repeat=repeat,
+            size=size,
+        )
+    )
+    remove_config_files(config_path)
+    config_path.unlink()
+    return results
+
+
+def bench_tree(work_path, args, rng):
+    tree_root = work_path / "tree"
+    started = time.perf_counter()
+    file_paths = generate_tree(
+        tree_root,
+        fanout=args.fanout,
+        depth=args.depth,
+        files=args.files,
+        symlink_density=args.symlink_density,
+        rng=rng,
+    )
+    print(
+        f"Generated tree with {len(file_paths)} files in "
+        + f"{time.perf_counter() - started:.2f}s",
+        file=sys.stderr,
+    )
+    size = len(file_paths)
+    config_path = work_path / "tree-config.yaml"
+    write_tree_config(config_path, tree_root, file_paths, args.categories)
+    batched_operations_path = work_path / "operations-batched.yaml"
+    write_operations(batched_operations_path, args.categories, "true {}+")
+    python_operations_path = work_path / "operations-python.yaml"
+    write_operations(
+        python_operations_path,
+        args.categories,
+        {"python": f"{__name__}:noop_operation", "batch": True},
+    )
+    rules_path = work_path / "rules.yaml"
+    with open(rules_path, "w") as f:
+        f.write(
+            dump_yaml(
+                [
+                    {"glob": "symlink-*", "categories": [get_category(0)]},
+                    {"regex": "/dir-0$", "categories": [get_category(1)]},
+                    {"glob": "*.txt", "categories": [get_category(2)]},
+                ]
+            )
+        )
+    classify_config_path = work_path / "classify-config.yaml"
+
+    def remove_classify_config():
+        remove_config_files(classify_config_path)
+        classify_config_path.unlink(missing_ok=True)
+
+    results = []
+    for jobs in sorted({1, args.jobs}):
+        results.append(
+            measure(
+                "validate",
+                lambda: run_cli(config_path, "validate", "-j", str(jobs)),
+                repeat=args.repeat,
+                size=size,
+                jobs=jobs,
+            )
+        )
+    for name, operations_path in [
+        ("apply_batched", batched_operations_path),
+        ("apply_python", python_operations_path),
+    ]:
+        results.append(
+            measure(
+                name,
+                lambda: run_cli(config_path, "apply", str(operations_path)),
+                repeat=args.repeat,
+                size=size,
+            )
+        )
+    for jobs in sorted({1, args.jobs}):
+        results.append(
+            measure(
+                "search_symlinks",
+                lambda: run_cli(config_path, "search-symlinks", "-j", str(jobs)),
+                repeat=args.repeat,
+                size=size,
+                jobs=jobs,
+            )
+        )
+    run_cli(config_path, "search-symlinks", "--cache")
+    results.append(
+        measure(
+            "search_symlinks_cached",
+            lambda: run_cli(config_path, "search-symlinks", "--cache"),
+            repeat=args.repeat,
+            size=size,
+        )
+    )
+    results.append(
+        measure(
+            "classify",
+            lambda: run_cli(
+                classify_config_path, "classify", str(rules_path), str(tree_root)
+            ),
+            setup=remove_classify_config,
+            repeat=args.repeat,
+            size=size,
+        )
+    )
+    return results
+
+
+def get_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_result_key(result):
+    return tuple(
+        (key, value)
+        for key, value in result.items()
+        if key not in ("repeat", "min", "mean")
+    )
+
+
+def compare_results(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {
+            get_result_key(result): result for result in json.load(f)["results"]
+        }
+    print(f'Compared to "{baseline_path}" (min time ratio)', file=sys.stderr)
+    for result in results:
+        baseline_result = baseline.get(get_result_key(result))
+        if baseline_result is None or not baseline_result["min"]:
+            continue
+        labels = " ".join(f"{key}={value}" for key, value in get_result_key(result))
+        print(
+            f'{labels:<56} {result["min"] / baseline_result["min"]:.2f}x',
+            file=sys.stderr,
+        )
+
+
+def get_arguments():
+    parser = ArgumentParser("ctgrzr-bench")
+    parser.add_argument(
+        "--sizes",
+        default="10000,100000",
+        help="Comma separated numbers of paths in synthetic configs",
+    )
+    parser.add_argument("--categories", type=int, default=8)
+    parser.add_argument(
+        "--fanout", type=int, default=8, help="Subdirectories per directory"
+    )
+    parser.add_argument("--depth", type=int, default=3, help="Depth of synthetic tree")
+    parser.add_argument("--files", type=int, default=10, help="Files per directory")
+    parser.add_argument(
+        "--symlink-density",
+        type=float,
+        default=0.05,
+        help="Probability of symlink next to each file",
+    )
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write results as JSON into the file")
+    parser.add_argument("--baseline", help="Results of previous run to compare with")
+    return parser.parse_args()
+
+
+def main():
+    args = get_arguments()
+    set_logging_level(logging.ERROR)
+    rng = random.Random(args.seed)
+    work_path = Path(tempfile.mkdtemp(prefix="ctgrzr-bench-"))
+    try:
+        results = []
+        for size in [int(size) for size in args.sizes.split(",") if size]:
+            results += bench_config(
+                work_path, size, categories=args.categories, repeat=args.repeat
+            )
+        results += bench_tree(work_path, args, rng)
+    finally:
+        shutil.rmtree(work_path)
+    report = {
+        "version": BENCH_RESULTS_VERSION,
+        "revision": get_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": vars(args),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        compare_results(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
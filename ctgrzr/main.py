@@ -1,6 +1,8 @@
 from src.cli import cli, get_arg_parser
-from src.logger import get_logger, set_logging_level
+from src.logger import enable_json_logging, get_logger, set_logging_level
+from src.profiling import profile_call
 from src.exception import AppException
+import atexit
 import traceback
 import sys
 import logging
@@ -14,7 +16,17 @@ def main():
             set_logging_level(logging.INFO)
         elif args.quiet:
             set_logging_level(logging.ERROR)
-        cli_result = cli(args)
+        if args.log_json:
+            # Stops the log writer thread before interpreter exits
+            atexit.register(enable_json_logging(args.log_json))
+        if args.profile:
+            cli_result = profile_call(
+                lambda: cli(args),
+                args.profile,
+                should_trace_memory=args.profile_memory,
+            )
+        else:
+            cli_result = cli(args)
         exit(cli_result)
     except AppException as e:
         get_logger().error(e)
@@ -0,0 +1,109 @@
+import json
+import os
+from pathlib import Path
+
+from .exception import AppException
+from .logger import get_logger
+from .operation import Operation, PythonOperation
+from .utils import truncate_partial_line, write_file_atomically
+
+APPLY_PLAN_VERSION = 1
+
+
+def get_apply_journal_path(plan_path):
+    return plan_path.with_name(f"{plan_path.name}.journal")
+
+
+def write_apply_plan(plan_path, operations):
+    get_logger().info(f'Writing apply plan to "{plan_path}"')
+    lines = [json.dumps({"version": APPLY_PLAN_VERSION})]
+    for operation in operations:
+        entry = {
+            "category": operation.category,
+            "paths": [str(path) for path in operation.paths],
+            "command": operation.command,
+        }
+        if operation.python_operation is not None:
+            entry["python"] = operation.python_operation.spec
+            entry["batch"] = operation.python_operation.batch
+        lines.append(json.dumps(entry))
+    write_file_atomically(plan_path, "\n".join(lines) + "\n")
+    journal_path = get_apply_journal_path(plan_path)
+    if journal_path.exists():
+        get_logger().warning(f'Removing stale apply journal "{journal_path}"')
+        journal_path.unlink()
+    return len(lines) - 1
+
+
+def load_apply_plan(plan_path):
+    get_logger().info(f'Loading apply plan from "{plan_path}"')
+    if not plan_path.exists():
+        raise AppException(f'Apply plan "{plan_path}" does not exist')
+    with open(plan_path) as f:
+        try:
+            header = json.loads(f.readline())
+            if header.get("version") != APPLY_PLAN_VERSION:
+                raise AppException(
+                    f'Apply plan "{plan_path}" has unsupported version, expected "{APPLY_PLAN_VERSION}"'
+                )
+            python_operations = {}
+            operations = []
+            for index, line in enumerate(f):
+                entry = json.loads(line)
+                python_operation = None
+                if "python" in entry:
+                    key = (entry["python"], entry["batch"])
+                    if key not in python_operations:
+                        python_operations[key] = PythonOperation(
+                            entry["python"], batch=entry["batch"]
+                        )
+                    python_operation = python_operations[key]
+                operations.append(
+                    Operation(
+                        entry["category"],
+                        [Path(path) for path in entry["paths"]],
+                        entry["command"],
+                        python_operation=python_operation,
+                        index=index,
+                    )
+                )
+            return operations
+        except (ValueError, KeyError, AttributeError) as e:
+            raise AppException(f'Apply plan "{plan_path}" is corrupted: {e}')
+
+
+def load_completed_operations(journal_path):
+    if not journal_path.exists():
+        return set()
+    completed_operations = set()
+    with open(journal_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            # Last line can be truncated by a crash while appending
+            if not line.endswith("\n"):
+                break
+            try:
+                completed_operations.add(int(line))
+            except ValueError as e:
+                raise AppException(
+                    f'Apply journal "{journal_path}" is corrupted on line {line_number}: {e}'
+                )
+    return completed_operations
+
+
+class ApplyJournal:
+    def __init__(self, journal_path):
+        self.journal_path = journal_path
+        self.file = None
+
+    def __enter__(self):
+        truncate_partial_line(self.journal_path)
+        self.file = open(self.journal_path, "a")
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def record(self, operation):
+        self.file.write(f"{operation.index}\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+
+from .logger import get_logger
+from .utils import write_file_atomically
+
+APPLY_STATE_VERSION = 1
+
+
+def get_apply_state_path(config_path):
+    return config_path.with_name(f"{config_path.name}.state")
+
+
+def hash_command_template(command_template):
+    # Python operations are hashed by their description (callable & batching)
+    if not isinstance(command_template, str):
+        command_template = f"{command_template} batch={command_template.batch}"
+    return hashlib.sha256(command_template.encode("utf-8")).hexdigest()[:16]
+
+
+def get_path_fingerprint(path):
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return [stat_result.st_mtime_ns, stat_result.st_size, stat_result.st_ino]
+
+
+def load_apply_state(state_path):
+    get_logger().info(f'Loading apply state from "{state_path}"')
+    if not state_path.exists():
+        return {}
+    with open(state_path) as f:
+        try:
+            data = json.load(f)
+        except ValueError:
+            get_logger().warning(f'Apply state "{state_path}" is corrupted, ignoring')
+            return {}
+    if data.get("version") != APPLY_STATE_VERSION:
+        get_logger().warning(
+            f'Apply state "{state_path}" has unsupported version, ignoring'
+        )
+        return {}
+    return data["entries"]
+
+
+def save_apply_state(state_path, state):
+    get_logger().info(f'Saving apply state to "{state_path}"')
+    write_file_atomically(
+        state_path, json.dumps({"version": APPLY_STATE_VERSION, "entries": state})
+    )
+
+
+def hash_operations_config(operations_config):
+    return {
+        category: hash_command_template(command_template)
+        for category, command_template in operations_config.items()
+    }
+
+
+def select_changed_paths(config, command_hashes, state):
+    changed_config = {}
+    next_state = {}
+    skipped_paths = 0
+    for category, paths in config.items():
+        command_hash = command_hashes[category]
+        category_state = state.get(category, {})
+        next_category_state = next_state.setdefault(category, {})
+        changed_config[category] = []
+        for path in paths:
+            entry = category_state.get(str(path))
+            fingerprint = get_path_fingerprint(path)
+            if (
+                entry is not None
+                and fingerprint is not None
+                and entry == [command_hash, *fingerprint]
+            ):
+                next_category_state[str(path)] = entry
+                skipped_paths += 1
+            else:
+                changed_config[category].append(path)
+    get_logger().info(f"Skipping {skipped_paths} path(s) unchanged since last apply")
+    return changed_config, next_state
+
+
+def record_applied_operation(state, command_hashes, operation):
+    command_hash = command_hashes[operation.category]
+    category_state = state.setdefault(operation.category, {})
+    for path in operation.paths:
+        fingerprint = get_path_fingerprint(path)
+        if fingerprint is not None:
+            category_state[str(path)] = [command_hash, *fingerprint]
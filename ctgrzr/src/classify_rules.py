@@ -0,0 +1,223 @@
+import fnmatch
+import os
+import re
+import time
+
+from .exception import AppException
+from .logger import get_logger
+from .utils import PathKind, load_yaml
+
+RULE_TYPES = {"file": PathKind.FILE, "directory": PathKind.DIRECTORY}
+RULE_PATTERN_KEYS = {"glob", "regex"}
+RULE_PREDICATE_KEYS = {"type", "min_size", "max_size", "min_age", "max_age"}
+RULE_KEYS = RULE_PATTERN_KEYS | RULE_PREDICATE_KEYS | {"categories"}
+# Group references (numbered, named or conditional), conservative as escaped
+# backslash followed by digit also matches
+GROUP_REFERENCE_REGEX = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+
+
+def get_rule_group_name(index):
+    return f"rule{index}"
+
+
+def compile_rule_regex(regex):
+    compiled_regex = re.compile(regex)
+    # Groups of combined regex are renumbered & their names have to be unique
+    if compiled_regex.groupindex or GROUP_REFERENCE_REGEX.search(regex):
+        return None, compiled_regex.search
+    # Searched for anywhere in the path, combined alternation only matches from
+    # the start, so the regex is prefixed there
+    pattern = f"(?s:.*?)(?:{regex})"
+    try:
+        re.compile(pattern)
+    except re.error:
+        # Global inline flags have to lead the pattern, regex is matched alone
+        pattern = None
+    return pattern, compiled_regex.search
+
+
+class ClassifyRule:
+    def __init__(self, index, definition):
+        self.index = index
+        self.categories = definition["categories"]
+        self.glob = definition.get("glob")
+        self.regex = definition.get("regex")
+        # Globs without separator match entry name, others the whole path
+        self.is_name_pattern = self.glob is not None and "/" not in self.glob
+        # Pattern is part of the combined regex, rule's own one is used after
+        self.pattern = None
+        self.search = None
+        if self.glob is not None:
+            self.pattern = fnmatch.translate(self.glob)
+            self.search = re.compile(self.pattern).match
+        elif self.regex is not None:
+            self.pattern, self.search = compile_rule_regex(self.regex)
+        self.kind = RULE_TYPES.get(definition.get("type"))
+        self.min_size = definition.get("min_size")
+        self.max_size = definition.get("max_size")
+        self.min_age = definition.get("min_age")
+        self.max_age = definition.get("max_age")
+        self.has_stat_predicate = any(
+            value is not None
+            for value in [self.min_size, self.max_size, self.min_age, self.max_age]
+        )
+
+    def matches(self, name, path, kind, get_stat, now):
+        if self.search is not None:
+            subject = name if self.is_name_pattern else path
+            if self.search(subject) is None:
+                return False
+        if self.kind is not None and kind != self.kind:
+            return False
+        if not self.has_stat_predicate:
+            return True
+        stat_result = get_stat()
+        if stat_result is None:
+            return False
+        size = stat_result.st_size
+        age = now - stat_result.st_mtime
+        return (
+            (self.min_size is None or size >= self.min_size)
+            and (self.max_size is None or size <= self.max_size)
+            and (self.min_age is None or age >= self.min_age)
+            and (self.max_age is None or age <= self.max_age)
+        )
+
+
+def compile_rule_patterns(rules):
+    if not rules:
+        return None
+    # Alternatives are tried in order, so the match is the first rule matching
+    try:
+        return re.compile(
+            "|".join(
+                f"(?P<{get_rule_group_name(rule.index)}>{rule.pattern})"
+                for rule in rules
+            )
+        )
+    except re.error as e:
+        raise AppException(f"Unable to combine classification rules: {e}")
+
+
+class ClassifyRules:
+    def __init__(self, rules):
+        self.rules = rules
+        self.name_regex = compile_rule_patterns(
+            [
+                rule
+                for rule in rules
+                if rule.pattern is not None and rule.is_name_pattern
+            ]
+        )
+        self.path_regex = compile_rule_patterns(
+            [
+                rule
+                for rule in rules
+                if rule.pattern is not None and not rule.is_name_pattern
+            ]
+        )
+        # Rules left out of combined regexes are candidates for every path
+        self.first_unconditional_index = next(
+            (rule.index for rule in rules if rule.pattern is None), None
+        )
+        self.group_indexes = {
+            get_rule_group_name(rule.index): rule.index for rule in rules
+        }
+        self.now = time.time()
+
+    def get_first_candidate_index(self, name, path):
+        candidate_indexes = []
+        for regex, subject in [(self.name_regex, name), (self.path_regex, path)]:
+            if regex is None:
+                continue
+            match = regex.match(subject)
+            if match is not None:
+                candidate_indexes.append(self.group_indexes[match.lastgroup])
+        if self.first_unconditional_index is not None:
+            candidate_indexes.append(self.first_unconditional_index)
+        return min(candidate_indexes, default=None)
+
+    def match(self, path, kind):
+        path = str(path)
+        name = os.path.basename(path)
+        first_candidate_index = self.get_first_candidate_index(name, path)
+        if first_candidate_index is None:
+            return None
+        stat_results = []
+
+        def get_stat():
+            if not stat_results:
+                try:
+                    stat_results.append(os.stat(path))
+                except OSError:
+                    stat_results.append(None)
+            return stat_results[0]
+
+        # Combined regexes find the first rule by pattern, if its predicates
+        # don't hold the following rules are checked one by one
+        for rule in self.rules[first_candidate_index:]:
+            if rule.matches(name, path, kind, get_stat, self.now):
+                return rule
+        return None
+
+
+def validate_classify_rule(index, definition):
+    location = f"Classification rule #{index + 1}"
+    if not isinstance(definition, dict):
+        raise AppException(f'{location} - expected mapping, got "{definition}"')
+    redundant_keys = set(definition.keys()) - RULE_KEYS
+    if redundant_keys:
+        raise AppException(
+            f'{location} - unknown keys {", ".join(sorted(redundant_keys))}'
+        )
+    categories = definition.get("categories")
+    if (
+        not isinstance(categories, list)
+        or not categories
+        or not all(isinstance(category, str) for category in categories)
+    ):
+        raise AppException(f"{location} - expected non-empty list of categories")
+    pattern_keys = RULE_PATTERN_KEYS & set(definition.keys())
+    if len(pattern_keys) > 1:
+        raise AppException(f'{location} - "glob" and "regex" are mutually exclusive')
+    if not pattern_keys and not (RULE_PREDICATE_KEYS & set(definition.keys())):
+        raise AppException(f"{location} - expected pattern or predicate")
+    for key in pattern_keys:
+        if not isinstance(definition[key], str):
+            raise AppException(f'{location} - "{key}" has to be string')
+    if "regex" in definition:
+        try:
+            re.compile(definition["regex"])
+        except re.error as e:
+            raise AppException(
+                f'{location} - invalid regex "{definition["regex"]}": {e}'
+            )
+    if "type" in definition and definition["type"] not in RULE_TYPES:
+        raise AppException(
+            f'{location} - "type" has to be one of {", ".join(RULE_TYPES)}'
+        )
+    for key in ["min_size", "max_size", "min_age", "max_age"]:
+        value = definition.get(key)
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0
+        ):
+            raise AppException(f'{location} - "{key}" has to be non-negative number')
+    return definition
+
+
+def load_classify_rules(rules_path):
+    get_logger().info(f'Loading classification rules from "{rules_path}"')
+    if not rules_path.exists():
+        raise AppException(f'Classification rules "{rules_path}" do not exist')
+    with open(rules_path) as f:
+        definitions = load_yaml(f.read())
+    if not isinstance(definitions, list) or not definitions:
+        raise AppException(
+            f'Classification rules "{rules_path}" have to be non-empty list of rules'
+        )
+    return ClassifyRules(
+        [
+            ClassifyRule(index, validate_classify_rule(index, definition))
+            for index, definition in enumerate(definitions)
+        ]
+    )
@@ -1,23 +1,75 @@
 from argparse import ArgumentParser
 from pathlib import Path
-from InquirerPy import inquirer
 import os
+import sys
 
+from .apply_state import get_apply_state_path
+from .classify_rules import load_classify_rules
 from .commands import (
     add,
+    add_from_stream,
     autoadd,
     apply,
+    classify,
+    compact,
     interactive,
     remove,
+    remove_from_stream,
+    resume_apply,
     search_symlinks,
     validate,
 )
 from .ctgrzr_config import load_config, save_config
-from .env import resolve_config_path
+from .env import CTGRZR_EXCLUDE_ENV, get_exclude_patterns, resolve_config_path
 from .exception import AppException
+from .exclude import ExcludeMatcher
+from .execution_records import NO_EXECUTION_RECORDS, ExecutionRecorder
+from .executor import EXECUTORS, SUBPROCESS_EXECUTOR
 from .logger import get_logger
 from .operation import load_operations_config
-from .utils import to_absolute_path
+from .progress import ProgressReporter
+from .scan_cache import get_scan_cache_path
+from .timings import get_timings, write_timings
+from .utils import read_paths_from_stream, to_absolute_path
+
+
+def add_path_arguments(parser, stdin_help):
+    # Either single path or paths from stdin, categories of --stdin are its own
+    path_group = parser.add_mutually_exclusive_group(required=True)
+    path_group.add_argument("--stdin", nargs="+", metavar="CATEGORY", help=stdin_help)
+    path_group.add_argument("path", nargs="?", help="Path")
+    parser.add_argument(
+        "-0",
+        "--null",
+        action="store_true",
+        help="Paths from stdin are NUL-delimited (e.g. find -print0)",
+    )
+
+
+def read_stream_arguments(args):
+    separator = b"\0" if args.null else b"\n"
+    paths = read_paths_from_stream(sys.stdin.buffer, separator)
+    return paths, args.stdin
+
+
+def add_exclude_argument(parser):
+    parser.add_argument(
+        "-e",
+        "--exclude",
+        action="append",
+        help="Glob of entries to skip with their subtrees, matched against the name "
+        + f'or the whole path if it contains "/" (also ${CTGRZR_EXCLUDE_ENV})',
+    )
+
+
+def add_jobs_argument(parser, help):
+    parser.add_argument("-j", "--jobs", type=int, default=1, help=help)
+
+
+def get_execution_recorder(args):
+    if not args.records:
+        return NO_EXECUTION_RECORDS
+    return ExecutionRecorder(to_absolute_path(Path(args.records)))
 
 
 def get_arg_parser():
@@ -26,6 +78,31 @@ def get_arg_parser():
     verbosity_group = parser.add_mutually_exclusive_group()
     verbosity_group.add_argument("-v", "--verbose", action="store_true", help="verbose")
     verbosity_group.add_argument("-q", "--quiet", action="store_true", help="quiet")
+    parser.add_argument(
+        "--log-json", help="Also write info log as JSON lines into the file"
+    )
+    parser.add_argument(
+        "--timings",
+        nargs="?",
+        const="-",
+        help="Write JSON breakdown of time per phase into the file (stderr if omitted)",
+    )
+    parser.add_argument(
+        "--progress",
+        action="store_true",
+        help="Report progress of long-running commands on stderr",
+    )
+    parser.add_argument(
+        "--progress-file", help="Keep JSON status of long-running commands in the file"
+    )
+    parser.add_argument(
+        "--profile", help="Write cProfile stats of the run into the file"
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="Report peak memory traced by tracemalloc (with --profile)",
+    )
     subparsers = parser.add_subparsers(title="commands", dest="command", required=True)
     parser_add = subparsers.add_parser("add", help="Add path to category")
     parser_add.add_argument(
@@ -34,16 +111,43 @@ def get_arg_parser():
     parser_add.add_argument(
         "-s", "--symlink", help="Allow symlink", action="store_true"
     )
-    parser_add.add_argument("path", help="Path")
-    parser_add.add_argument("categories", help="Categories", nargs="+")
+    add_path_arguments(parser_add, "Read paths from stdin, add them to the categories")
+    parser_add.add_argument("categories", help="Categories", nargs="*")
     parser_apply = subparsers.add_parser(
         "apply", help="Applies operations, by definfed YAML file"
     )
     parser_apply.add_argument(
         "-s", "--strict", action="store_true", help="Fails on 1st failed operation"
     )
+    add_jobs_argument(parser_apply, "Number of operations running concurrently")
+    parser_apply.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="Skip paths unchanged since their last successful operation",
+    )
     parser_apply.add_argument(
-        "operations", help="File containing yaml definitions of operations to apply"
+        "--executor",
+        choices=EXECUTORS,
+        default=SUBPROCESS_EXECUTOR,
+        help="How commands are run, coprocess reuses long-lived shell workers",
+    )
+    parser_apply.add_argument(
+        "--records",
+        help="Write JSON line per executed operation (duration, exit code, resource "
+        + "usage) into the file and summarize the slowest ones",
+    )
+    apply_plan_group = parser_apply.add_mutually_exclusive_group()
+    apply_plan_group.add_argument(
+        "--plan", help="Only write the expanded operations into the plan file"
+    )
+    apply_plan_group.add_argument(
+        "--resume", help="Run operations from the plan file, skipping completed ones"
+    )
+    parser_apply.add_argument(
+        "operations",
+        nargs="?",
+        help="File containing yaml definitions of operations to apply",
     )
     parser_autoadd = subparsers.add_parser(
         "autoadd",
@@ -55,9 +159,29 @@ def get_arg_parser():
     parser_autoadd.add_argument(
         "-s", "--symlinks", help="Allow symlinks", action="store_true"
     )
+    add_jobs_argument(parser_autoadd, "Number of concurrent filesystem checks")
     parser_autoadd.add_argument(
         "template", help="Template config file (same as for -c option"
     )
+    parser_classify = subparsers.add_parser(
+        "classify", help="Walks the FS and categorizes paths by rules"
+    )
+    parser_classify.add_argument(
+        "-s", "--symlinks", help="Include symlinks", action="store_true"
+    )
+    parser_classify.add_argument(
+        "--max-depth", help="Max depth when walking the FS", type=int
+    )
+    add_exclude_argument(parser_classify)
+    parser_classify.add_argument(
+        "rules", help="File containing ordered yaml list of classification rules"
+    )
+    parser_classify.add_argument(
+        "paths", nargs="*", help="Root path(s), defaults to $PWD if skipped"
+    )
+    subparsers.add_parser(
+        "compact", help="Folds journal of changes into the config file"
+    )
     parser_interactive = subparsers.add_parser(
         "interactive", help="Walks the FS interactively"
     )
@@ -85,6 +209,7 @@ def get_arg_parser():
         help="Don't check for symlinks after categorization",
         action="store_true",
     )
+    add_exclude_argument(parser_interactive)
     parser_interactive.add_argument(
         "paths", nargs="*", help="Root path(s), defaults to $PWD if skipped"
     )
@@ -92,15 +217,34 @@ def get_arg_parser():
     parser_remove.add_argument(
         "-f", "--force", action="store_true", help="No error if path is not found"
     )
-    parser_remove.add_argument("path", help="Path")
+    add_path_arguments(
+        parser_remove, "Read paths from stdin, remove them from the categories"
+    )
     parser_remove.add_argument("categories", help="categories", nargs="*")
     parser_search_symlinks = subparsers.add_parser(
         "search-symlinks", help="Checks if any paths in config contains symlinks"
     )
     parser_search_symlinks.add_argument("-i", "--interactive", action="store_true")
+    add_jobs_argument(parser_search_symlinks, "Number of roots searched concurrently")
+    parser_search_symlinks.add_argument(
+        "-x",
+        "--one-file-system",
+        action="store_true",
+        help="Don't descend into directories on other filesystems",
+    )
+    parser_search_symlinks.add_argument(
+        "--max-depth", help="Max depth when walking the FS", type=int
+    )
+    add_exclude_argument(parser_search_symlinks)
+    parser_search_symlinks.add_argument(
+        "--cache",
+        action="store_true",
+        help="Skip listing directories unchanged since the previous cached scan",
+    )
     parser_validate = subparsers.add_parser(
         "validate", help="Checks if paths exist on current filesystem"
     )
+    add_jobs_argument(parser_validate, "Number of concurrent filesystem checks")
     parser_validate.add_argument("categories", help="Categories", nargs="*")
 
     return parser
@@ -108,32 +252,94 @@ def get_arg_parser():
 
 def cli(args):
     get_logger().info("Running in verbose mode")
+    get_timings().reset()
     cli_result = 0
     config_path = resolve_config_path(args.config)
     should_write_config = False
-    config = load_config(config_path)
-    if args.command == "add":
+    progress = ProgressReporter(
+        should_render=args.progress,
+        status_path=(
+            to_absolute_path(Path(args.progress_file)) if args.progress_file else None
+        ),
+    )
+    with get_timings().phase("load"):
+        config = load_config(config_path)
+    command_started = get_timings().start()
+    if args.command == "add" and args.stdin:
+        paths, categories = read_stream_arguments(args)
+        cli_result, should_write_config = add_from_stream(
+            config, paths, categories, force=args.force, allow_symlink=args.symlink
+        )
+    elif args.command == "add":
         path = to_absolute_path(Path(args.path))
         cli_result, should_write_config = add(
             config, path, args.categories, force=args.force, allow_symlink=args.symlink
         )
+    elif args.command == "apply" and args.resume:
+        if args.incremental:
+            raise AppException('Option "--incremental" cannot be used with "--resume"')
+        cli_result, should_write_config = resume_apply(
+            to_absolute_path(Path(args.resume)),
+            strict=args.strict,
+            jobs=args.jobs,
+            executor=args.executor,
+            progress=progress,
+            records=get_execution_recorder(args),
+        )
     elif args.command == "apply":
+        if args.operations is None:
+            raise AppException("Operations config not specified")
+        if args.plan and args.incremental:
+            raise AppException('Option "--incremental" cannot be used with "--plan"')
         operations_config = load_operations_config(
             to_absolute_path(Path(args.operations)),
             validate_expected_keys=config.keys(),
         )
         cli_result, should_write_config = apply(
-            config, operations_config, strict=args.strict
+            config,
+            operations_config,
+            strict=args.strict,
+            jobs=args.jobs,
+            state_path=(
+                get_apply_state_path(config_path) if args.incremental else None
+            ),
+            plan_path=to_absolute_path(Path(args.plan)) if args.plan else None,
+            executor=args.executor,
+            progress=progress,
+            records=get_execution_recorder(args),
         )
     elif args.command == "autoadd":
         template_config_path = to_absolute_path(Path(args.template))
         if template_config_path == config_path:
             raise AppException("Config and template config path cannot be same")
-        template_config = load_config(template_config_path)
+        # Template is only read once, caching it would just litter its directory
+        template_config = load_config(template_config_path, should_cache=False)
         cli_result, should_write_config = autoadd(
-            config, template_config, force=args.force, allow_symlinks=args.symlinks
+            config,
+            template_config,
+            force=args.force,
+            allow_symlinks=args.symlinks,
+            jobs=args.jobs,
+            progress=progress,
+        )
+    elif args.command == "classify":
+        rules = load_classify_rules(to_absolute_path(Path(args.rules)))
+        root_paths = (
+            [Path(path) for path in args.paths] if args.paths else [Path(os.getcwd())]
+        )
+        cli_result, should_write_config = classify(
+            config,
+            rules,
+            [to_absolute_path(root_path) for root_path in root_paths],
+            max_depth=args.max_depth,
+            should_include_symlinks=args.symlinks,
+            exclude=ExcludeMatcher(get_exclude_patterns(args.exclude)),
         )
+    elif args.command == "compact":
+        cli_result, should_write_config = compact(config_path, config)
     elif args.command == "interactive":
+        from InquirerPy import inquirer
+
         is_possible_overwrite_due_to_existing_config = (
             config_path.exists()
             and inquirer.confirm(
@@ -158,6 +364,7 @@ def cli(args):
             initial_config=initial_config,
             max_depth=args.max_depth,
             should_include_symlinks=args.symlinks,
+            exclude=ExcludeMatcher(get_exclude_patterns(args.exclude)),
         )
         should_search_for_symlinks = (not args.skip_symlink_check) and inquirer.confirm(
             message="Do you want run symlink check on config file?", default=False
@@ -167,8 +374,16 @@ def cli(args):
                 message="Do you want to pick which entries to check"
             ).execute()
             search_symlinks(
-                config, interactive=should_run_interactive, should_use_logger=True
+                config,
+                interactive=should_run_interactive,
+                should_use_logger=True,
+                exclude=ExcludeMatcher(get_exclude_patterns(args.exclude)),
             )
+    elif args.command == "remove" and args.stdin:
+        paths, categories = read_stream_arguments(args)
+        cli_result, should_write_config = remove_from_stream(
+            config, paths, categories, force=args.force
+        )
     elif args.command == "remove":
         path = to_absolute_path(Path(args.path))
         cli_result, should_write_config = remove(
@@ -176,12 +391,26 @@ def cli(args):
         )
     elif args.command == "search-symlinks":
         cli_result, should_write_config = search_symlinks(
-            config, interactive=args.interactive, should_use_logger=False
+            config,
+            interactive=args.interactive,
+            should_use_logger=False,
+            jobs=args.jobs,
+            one_file_system=args.one_file_system,
+            exclude=ExcludeMatcher(get_exclude_patterns(args.exclude)),
+            max_depth=args.max_depth,
+            scan_cache_path=get_scan_cache_path(config_path) if args.cache else None,
+            progress=progress,
         )
     elif args.command == "validate":
-        cli_result, should_write_config = validate(config, args.categories)
+        cli_result, should_write_config = validate(
+            config, args.categories, jobs=args.jobs, progress=progress
+        )
     else:
         raise AppException(f'Unknown command "{args.command}"')
+    get_timings().record("command", command_started)
     if should_write_config:
-        save_config(config_path, config)
+        with get_timings().phase("save"):
+            save_config(config_path, config)
+    if args.timings:
+        write_timings(args.timings)
     return cli_result
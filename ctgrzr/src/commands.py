@@ -1,61 +1,292 @@
-from collections import deque
-
-from InquirerPy import inquirer
-from InquirerPy.base import Choice
-
 from .symlinks import search_symlinks_in_directories
 
+from .apply_plan import (
+    ApplyJournal,
+    get_apply_journal_path,
+    load_apply_plan,
+    load_completed_operations,
+    write_apply_plan,
+)
+from .apply_state import (
+    hash_operations_config,
+    load_apply_state,
+    record_applied_operation,
+    save_apply_state,
+    select_changed_paths,
+)
 from .ctgrzr_config import (
+    CtgrzrConfig,
     add_path,
-    get_paths_from_config,
+    compact_config,
     remove_path,
-    transform_config_by_path,
+    validate_categories_exist,
 )
 from .exception import AppException
-from .fs_walk import should_process_path, ProcessPath, DequeOperation, process_path
+from .exclude import NO_EXCLUDE
+from .execution_records import NO_EXECUTION_RECORDS
+from .executor import SUBPROCESS_EXECUTOR, run_operations
+from .fs_walk import (
+    classify_walk_path,
+    get_next_path,
+    iterate_directory,
+    iterate_paths,
+    prefetch_paths,
+    should_process_path,
+    process_path,
+)
 from .logger import get_logger
-from .operation import run_command
+from .operation import expand_operations
+from .progress import NO_PROGRESS
+from .scan_cache import load_scan_cache, save_scan_cache
+from .utils import PathKind, classify_path, classify_paths
+
+
+def validate_path_to_add(path, *, allow_symlink, classification=None):
+    path_kind, is_symlink = classification or classify_path(path)
+    if path_kind == PathKind.MISSING:
+        return f'Path "{path}" does not exist'
+    if path_kind == PathKind.OTHER:
+        return f'Path "{path}" should be regular file or directory'
+    if not allow_symlink and is_symlink:
+        return f'Path "{path}" cannot be a symlink, otherwise run with "-s" option'
+
+
+def raise_errors(errors):
+    raise AppException(
+        "\n".join(
+            ["Following errors were encountered"] + [f"* {error}" for error in errors]
+        )
+    )
 
 
 def add(config, path, categories, *, force=False, allow_symlink=False):
     get_logger().info('Running "add" command')
     if not categories:
         raise AppException("No category specified")
-    if not path.exists():
-        raise AppException(f'Path "{path}" does not exist')
-    if not (path.is_file() or path.is_dir()):
-        raise AppException(f'Path "{path}" should be regular file or directory')
-
-    if not allow_symlink and path.is_symlink():
-        raise AppException(
-            f'Path "{path}" cannot be a symlink, otherwise run with "-s" option'
-        )
+    validation_error = validate_path_to_add(path, allow_symlink=allow_symlink)
+    if validation_error:
+        raise AppException(validation_error)
     config = add_path(config, path, categories, force)
     return 0, True
 
 
-def autoadd(config, template_config, *, force=False, allow_symlinks=False):
+def report_stream_errors(errors, processed_paths):
+    if not errors:
+        get_logger().info(f"Processed {processed_paths} path(s)")
+        return 0
+    get_logger().error(
+        "\n".join(
+            [f"{len(errors)} of {processed_paths} path(s) failed"]
+            + [f"* {error}" for error in errors]
+        )
+    )
+    return 1
+
+
+def add_from_stream(config, paths, categories, *, force=False, allow_symlink=False):
+    get_logger().info('Running "add" command with paths from stream')
+    if not categories:
+        raise AppException("No category specified")
+    errors = []
+    processed_paths = 0
+    for path in paths:
+        processed_paths += 1
+        error = validate_path_to_add(path, allow_symlink=allow_symlink)
+        if not error and not force:
+            existing_categories = [
+                category for category in categories if config.has_path(path, category)
+            ]
+            if existing_categories:
+                error = f'Path "{path}" already present in categories {", ".join(existing_categories)}'
+        if error:
+            errors.append(error)
+            continue
+        add_path(config, path, categories, force)
+    return report_stream_errors(errors, processed_paths), True
+
+
+def autoadd(
+    config,
+    template_config,
+    *,
+    force=False,
+    allow_symlinks=False,
+    jobs=1,
+    progress=NO_PROGRESS,
+):
     get_logger().info('Running "autoadd" command')
-    template_config_by_path = transform_config_by_path(template_config)
-    for path, categories in template_config_by_path.items():
-        should_add = path.exists() and (path.is_file() or path.is_dir())
-        if should_add:
-            add(config, path, categories, force=force, allow_symlink=allow_symlinks)
+    progress.start("autoadd", len(template_config.get_paths()))
+    for path, classification in classify_paths(template_config.get_paths(), jobs=jobs):
+        progress.update()
+        path_kind, _ = classification
+        if path_kind not in (PathKind.FILE, PathKind.DIRECTORY):
+            continue
+        validation_error = validate_path_to_add(
+            path, allow_symlink=allow_symlinks, classification=classification
+        )
+        if validation_error:
+            raise AppException(validation_error)
+        add_path(config, path, template_config.get_categories(path), force)
+    progress.finish()
     return 0, True
 
 
-def apply(config, operations_config, *, strict=True):
+def classify(
+    config,
+    rules,
+    root_paths,
+    *,
+    max_depth=None,
+    should_include_symlinks=False,
+    exclude=NO_EXCLUDE,
+):
+    get_logger().info('Running "classify" command')
+    classified_paths = 0
+    # Classified directories are taken as a whole, only the others are entered
+    stack = [(iterate_paths(root_paths), 0)]
+    while stack:
+        paths, depth = stack[-1]
+        try:
+            path = next(paths)
+        except StopIteration:
+            stack.pop()
+            continue
+        except OSError as e:
+            get_logger().warning(f"Unable to list directory: {e}")
+            stack.pop()
+            continue
+        entry = classify_walk_path(path)
+        if not should_process_path(path, should_include_symlinks, entry=entry):
+            continue
+        rule = rules.match(path, entry.kind)
+        if rule is not None:
+            # Rerun over classified tree only adds what is missing
+            missing_categories = [
+                category
+                for category in rule.categories
+                if not config.has_path(path, category)
+            ]
+            if missing_categories:
+                add_path(config, path, missing_categories, False)
+                classified_paths += 1
+        elif (
+            entry.kind == PathKind.DIRECTORY
+            and not entry.is_symlink
+            and (max_depth is None or depth < max_depth)
+        ):
+            stack.append((iterate_directory(path, exclude), depth + 1))
+    if classified_paths == 0:
+        get_logger().warning("No paths were classified")
+    return 0, True
+
+
+def raise_failed_operations(failed_operations):
+    raise AppException(
+        "\n".join(
+            ["Following operations failed"]
+            + [
+                f'* Category "{operation.category}" - "{operation.command}"'
+                for operation in failed_operations
+            ]
+        )
+    )
+
+
+def apply(
+    config,
+    operations_config,
+    *,
+    strict=True,
+    jobs=1,
+    state_path=None,
+    plan_path=None,
+    executor=SUBPROCESS_EXECUTOR,
+    progress=NO_PROGRESS,
+    records=NO_EXECUTION_RECORDS,
+):
     get_logger().info('Running "apply" command')
-    for category, paths in config.items():
-        command_template = operations_config[category]
-        for path in paths:
-            try:
-                command = command_template.replace("{}", str(path))
-                run_command(command, should_redirect_to_stdout=True, check=True)
-            except AppException as e:
-                if strict:
-                    raise e
-                get_logger().error(e)
+    on_success = None
+    if state_path is not None:
+        command_hashes = hash_operations_config(operations_config)
+        config, state = select_changed_paths(
+            config, command_hashes, load_apply_state(state_path)
+        )
+
+        def on_success(operation):
+            record_applied_operation(state, command_hashes, operation)
+
+    operations = expand_operations(config, operations_config)
+    if plan_path is not None:
+        planned_operations = write_apply_plan(plan_path, operations)
+        get_logger().info(f"Planned {planned_operations} operation(s)")
+        return 0, False
+    # Progress is counted in paths, number of (batched) operations isn't known
+    progress.start("apply", sum(len(paths) for _, paths in config.items()))
+    try:
+        with records:
+            failed_operations = run_operations(
+                operations,
+                strict=strict,
+                jobs=jobs,
+                on_success=on_success,
+                executor=executor,
+                progress=progress,
+                records=records,
+            )
+    finally:
+        progress.finish()
+        if state_path is not None:
+            save_apply_state(state_path, state)
+    if strict and failed_operations:
+        raise_failed_operations(failed_operations)
+    return 0, False
+
+
+def resume_apply(
+    plan_path,
+    *,
+    strict=True,
+    jobs=1,
+    executor=SUBPROCESS_EXECUTOR,
+    progress=NO_PROGRESS,
+    records=NO_EXECUTION_RECORDS,
+):
+    get_logger().info('Resuming "apply" command')
+    operations = load_apply_plan(plan_path)
+    journal_path = get_apply_journal_path(plan_path)
+    completed_operations = load_completed_operations(journal_path)
+    remaining_operations = [
+        operation
+        for operation in operations
+        if operation.index not in completed_operations
+    ]
+    get_logger().info(
+        f"{len(operations) - len(remaining_operations)} of {len(operations)} operation(s) already completed"
+    )
+    progress.start(
+        "apply", sum(len(operation.paths) for operation in remaining_operations)
+    )
+    with ApplyJournal(journal_path) as journal, records:
+        try:
+            failed_operations = run_operations(
+                remaining_operations,
+                strict=strict,
+                jobs=jobs,
+                on_success=journal.record,
+                executor=executor,
+                progress=progress,
+                records=records,
+            )
+        finally:
+            progress.finish()
+    if strict and failed_operations:
+        raise_failed_operations(failed_operations)
+    return 0, False
+
+
+def compact(config_path, config):
+    get_logger().info('Running "compact" command')
+    compact_config(config_path, config)
     return 0, False
 
 
@@ -67,32 +298,35 @@ def interactive(
     initial_config,
     max_depth,
     should_include_symlinks=False,
+    exclude=NO_EXCLUDE,
 ):
     get_logger().info('Running "interactive" command')
-    dq = deque([ProcessPath(root_path) for root_path in root_paths])
     categories = operations_config.keys()
-    ctx = dict(config=config, dq=dq, categories=categories, current_depth=0)
-    initial_config_by_path = (
-        {} if initial_config is None else transform_config_by_path(initial_config)
+    # Roots form the bottom level, every step-into pushes lazy directory iterator
+    # classified ahead in background
+    ctx = dict(
+        config=config,
+        stack=[prefetch_paths(root_paths)],
+        categories=categories,
+        current_depth=0,
+        exclude=exclude,
     )
+    initial_config = CtgrzrConfig() if initial_config is None else initial_config
     should_continue = True
     processed_items = 0
-    while should_continue and dq:
-        dq_operation = dq.popleft()
-        if dq_operation == DequeOperation.DECREMENT_DEPTH:
-            ctx["current_depth"] -= 1
-        elif isinstance(dq_operation, ProcessPath):
-            path = dq_operation.path
-            if should_process_path(path, should_include_symlinks):
-                ctx["path"] = path
-                should_continue, ctx = process_path(
-                    ctx,
-                    initial_config_by_path=initial_config_by_path,
-                    max_depth=max_depth,
-                )
-                processed_items += 1
-        else:
-            raise AppException(f'Invalid operation "{dq_operation}"')
+    while should_continue:
+        entry = get_next_path(ctx)
+        if entry is None:
+            break
+        if should_process_path(entry.path, should_include_symlinks, entry=entry):
+            ctx["path"] = entry.path
+            ctx["is_dir"] = entry.kind == PathKind.DIRECTORY
+            should_continue, ctx = process_path(
+                ctx,
+                initial_config=initial_config,
+                max_depth=max_depth,
+            )
+            processed_items += 1
     if processed_items == 0:
         get_logger().warning("No items were actually processed")
 
@@ -107,10 +341,41 @@ def remove(config, path, categories, *, force=False):
     return 0, True
 
 
-def search_symlinks(config, *, interactive, should_use_logger):
+def remove_from_stream(config, paths, categories, *, force=False):
+    get_logger().info('Running "remove" command with paths from stream')
+    if not categories:
+        raise AppException("No category specified")
+    # Checked once, stream isn't read at all if any of them is missing
+    validate_categories_exist(config, categories)
+    errors = []
+    processed_paths = 0
+    for path in paths:
+        processed_paths += 1
+        try:
+            remove_path(config, path, categories, force)
+        except AppException as e:
+            errors.append(str(e))
+    return report_stream_errors(errors, processed_paths), True
+
+
+def search_symlinks(
+    config,
+    *,
+    interactive,
+    should_use_logger,
+    jobs=1,
+    one_file_system=False,
+    exclude=NO_EXCLUDE,
+    max_depth=None,
+    scan_cache_path=None,
+    progress=NO_PROGRESS,
+):
     get_logger().info('Running "search_symlinks" command')
-    paths = get_paths_from_config(config)
+    paths = config.get_paths()
     if interactive:
+        from InquirerPy import inquirer
+        from InquirerPy.base import Choice
+
         symlink_paths = set([path for path in paths if path.is_symlink()])
         all_directory_paths = [path for path in paths if path.is_dir()]
         paths = inquirer.checkbox(
@@ -120,34 +385,58 @@ def search_symlinks(config, *, interactive, should_use_logger):
         paths = set(paths) | symlink_paths
     logger = get_logger()
     output = logger.warning if should_use_logger else print
-    for symlink in search_symlinks_in_directories(paths):
-        output(f'Symlink found: "{symlink}"')
+    scan_cache = None if scan_cache_path is None else load_scan_cache(scan_cache_path)
+    # Counted in scanned directories as the walk goes, total isn't known upfront
+    progress.start("search-symlinks")
+    for symlink_match in search_symlinks_in_directories(
+        paths,
+        jobs=jobs,
+        one_file_system=one_file_system,
+        exclude=exclude,
+        max_depth=max_depth,
+        scan_cache=scan_cache,
+        progress=progress,
+    ):
+        roots = ", ".join(f'"{root}"' for root in symlink_match.roots)
+        output(f'Symlink found: "{symlink_match.path}" (in {roots})')
+        if symlink_match.is_target_outside:
+            output(
+                f'Symlink "{symlink_match.path}" points outside of categorized paths: "{symlink_match.target}"'
+            )
+    progress.finish()
+    if scan_cache is not None:
+        save_scan_cache(scan_cache_path, scan_cache)
     return 0, False
 
 
-def validate(config, categories):
+def validate(config, categories, *, jobs=1, progress=NO_PROGRESS):
     get_logger().info('Running "validate" command')
     validation_errors = []
     if not categories:
         get_logger().info("No categories specified, assuming all")
         categories = list(config.keys())
-    for category, paths in config.items():
-        if category not in categories:
+    # Paths shared by multiple categories are checked once
+    paths = {
+        path: None
+        for category, category_paths in config.items()
+        if category in categories
+        for path in category_paths
+    }
+    progress.start("validate", len(paths))
+    for path, (path_kind, _) in classify_paths(paths, jobs=jobs):
+        progress.update(failed=path_kind not in (PathKind.FILE, PathKind.DIRECTORY))
+        if path_kind == PathKind.MISSING:
+            message = "does not exist"
+        elif path_kind == PathKind.OTHER:
+            message = "should be regular file or directory"
+        else:
             continue
-        for path in paths:
-            if not path.exists():
+        for category in config.get_categories(path):
+            if category in categories:
                 validation_errors.append(
-                    f'Category "{category}" - Path "{path}" does not exist'
-                )
-            if not (path.is_file() or path.is_dir()):
-                validation_errors.append(
-                    f'Category "{category}" - Path "{path}" should be regular file or directory'
+                    f'Category "{category}" - Path "{path}" {message}'
                 )
+    progress.finish()
     if validation_errors:
-        raise AppException(
-            "\n".join(
-                ["Following errors were encountered"]
-                + [f"* {error}" for error in validation_errors]
-            )
-        )
+        raise_errors(validation_errors)
     return 0, False
@@ -1,49 +1,269 @@
-import yaml
+import json
+import logging
+import marshal
+import os
 from pathlib import Path
-from collections import Counter
 
 from .env import CTGRZR_CONFIG_DEFAULT
 from .exception import AppException
 from .logger import get_logger
-from .utils import to_absolute_path, validate_writable_directory
+from .timings import get_timings
+from .utils import (
+    dump_yaml,
+    load_yaml,
+    to_absolute_path,
+    truncate_partial_line,
+    validate_writable_directory,
+    write_file_atomically,
+)
 
-EMPTY_CTGRZR_CONFIG = {}
+# Bump whenever the cached structure changes
+CONFIG_CACHE_VERSION = 1
+
+JOURNAL_ADD = "add"
+JOURNAL_REMOVE = "remove"
+# Journal is folded into the config once it outgrows both this & the config
+JOURNAL_MIN_COMPACTION_SIZE = 1000
+
+
+class CtgrzrConfig:
+    def __init__(self):
+        # Dicts with "None" values serve as insertion-ordered sets
+        self.paths_by_category = {}
+        self.categories_by_path = {}
+        # Mutations not persisted yet & number of entries in the journal
+        self.changes = []
+        self.journal_size = 0
+
+    def __contains__(self, category):
+        return category in self.paths_by_category
+
+    def __getitem__(self, category):
+        return self.paths_by_category[category].keys()
+
+    def __iter__(self):
+        return iter(self.paths_by_category)
+
+    def __len__(self):
+        return len(self.paths_by_category)
+
+    def keys(self):
+        return self.paths_by_category.keys()
+
+    def items(self):
+        for category, paths in self.paths_by_category.items():
+            yield category, paths.keys()
+
+    def items_by_path(self):
+        for path, categories in self.categories_by_path.items():
+            yield path, list(categories)
+
+    def add_category(self, category):
+        if category not in self.paths_by_category:
+            self.paths_by_category[category] = {}
+
+    def has_path(self, path, category=None):
+        if category is None:
+            return path in self.categories_by_path
+        return path in self.paths_by_category.get(category, ())
+
+    def get_categories(self, path):
+        return list(self.categories_by_path.get(path, ()))
+
+    def get_paths(self):
+        return self.categories_by_path.keys()
+
+    def add(self, category, path):
+        self.add_category(category)
+        if path in self.paths_by_category[category]:
+            return
+        self.paths_by_category[category][path] = None
+        self.categories_by_path.setdefault(path, {})[category] = None
+        self.changes.append((JOURNAL_ADD, category, path))
+
+    def discard(self, category, path):
+        if path not in self.paths_by_category[category]:
+            return
+        del self.paths_by_category[category][path]
+        categories = self.categories_by_path[path]
+        del categories[category]
+        if not categories:
+            del self.categories_by_path[path]
+        self.changes.append((JOURNAL_REMOVE, category, path))
+
+    def to_dict(self):
+        return {
+            category: list(paths) for category, paths in self.paths_by_category.items()
+        }
 
 
 def validate_config(config):
     get_logger().info("Validating configuration")
+    if not isinstance(config, dict):
+        raise AppException("Configuration has to be mapping of categories to paths")
     for category, paths in config.items():
-        locations = Counter(paths)
-        duplicate_locations = [loc for loc, cnt in locations.items() if cnt > 1]
-        if duplicate_locations:
-            raise AppException(
-                f'Category "{category}" has duplicate paths: {(", ".join(duplicate_locations))}'
-            )
+        if not isinstance(paths, list):
+            raise AppException(f'Category "{category}" has to contain list of paths')
     return config
 
 
 def serialize_config(config):
     get_logger().info("Serializing configuration")
-    for category, paths in config.items():
-        config[category] = [str(path) for path in paths]
-    return config
+    return {
+        category: [str(path) for path in paths] for category, paths in config.items()
+    }
 
 
 def deserialize_config(config):
     get_logger().info("Deserializing configuration")
+    ctgrzr_config = CtgrzrConfig()
     for category, paths in config.items():
-        config[category] = [to_absolute_path(Path(path)) for path in paths]
+        ctgrzr_config.add_category(category)
+        duplicate_locations = []
+        for path in paths:
+            path = to_absolute_path(Path(path))
+            if ctgrzr_config.has_path(path, category):
+                duplicate_locations.append(str(path))
+            ctgrzr_config.add(category, path)
+        if duplicate_locations:
+            raise AppException(
+                f'Category "{category}" has duplicate paths: {(", ".join(duplicate_locations))}'
+            )
+    ctgrzr_config.changes.clear()
+    return ctgrzr_config
+
+
+def is_config_cwd_dependent(config):
+    return any(
+        not str(path).startswith(("/", "~"))
+        for paths in config.values()
+        for path in paths
+    )
+
+
+def get_config_cache_path(config_path):
+    return config_path.with_name(f"{config_path.name}.cache")
+
+
+def get_config_cache_key(stat_result):
+    # Home directory is part of the key, because of "~" expansion
+    return [
+        CONFIG_CACHE_VERSION,
+        stat_result.st_mtime_ns,
+        stat_result.st_size,
+        stat_result.st_ino,
+        str(Path.home()),
+    ]
+
+
+def load_config_cache(config_path, stat_result):
+    cache_path = get_config_cache_path(config_path)
+    try:
+        with open(cache_path, "rb") as f:
+            cache_key, cwd, entries = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if cache_key != get_config_cache_key(stat_result):
+        get_logger().info(f'Config cache "{cache_path}" is stale')
+        return None
+    if cwd is not None and cwd != os.getcwd():
+        get_logger().info(f'Config cache "{cache_path}" was built in other directory')
+        return None
+    get_logger().info(f'Loading config from cache "{cache_path}"')
+    config = CtgrzrConfig()
+    for category, paths in entries.items():
+        config.add_category(category)
+        for path in paths:
+            config.add(category, Path(path))
+    config.changes.clear()
+    return config
+
+
+def save_config_cache(config_path, config, stat_result, *, is_cwd_dependent=False):
+    cache_path = get_config_cache_path(config_path)
+    # Config can be shared read-only, it's then parsed every time
+    if not os.access(cache_path.parent, os.W_OK):
+        get_logger().debug(f'Skipping config cache "{cache_path}", not writable')
+        return
+    get_logger().info(f'Saving config cache "{cache_path}"')
+    # Relative paths are resolved against working directory, cache has to be
+    # bound to it then
+    cwd = os.getcwd() if is_cwd_dependent else None
+    data = marshal.dumps(
+        [get_config_cache_key(stat_result), cwd, serialize_config(config)]
+    )
+    try:
+        write_file_atomically(cache_path, data, mode="wb")
+    except OSError as e:
+        get_logger().warning(f'Unable to write config cache "{cache_path}": {e}')
+
+
+def get_config_journal_path(config_path):
+    return config_path.with_name(f"{config_path.name}.journal")
+
+
+def replay_config_journal(config_path, config):
+    journal_path = get_config_journal_path(config_path)
+    if not journal_path.exists():
+        return config
+    get_logger().info(f'Replaying config journal "{journal_path}"')
+    with open(journal_path) as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.endswith("\n"):
+                get_logger().warning(
+                    f'Ignoring truncated entry in config journal "{journal_path}"'
+                )
+                break
+            try:
+                operation, category, path = json.loads(line)
+            except ValueError:
+                raise AppException(
+                    f'Config journal "{journal_path}" is corrupted on line {line_number}'
+                )
+            if operation == JOURNAL_ADD:
+                config.add(category, Path(path))
+            elif operation == JOURNAL_REMOVE:
+                if category in config:
+                    config.discard(category, Path(path))
+            else:
+                raise AppException(
+                    f'Config journal "{journal_path}" has unknown operation "{operation}" on line {line_number}'
+                )
+            config.journal_size += 1
+    config.changes.clear()
+    return config
+
+
+def load_base_config(config_path, *, should_cache=True):
+    # Stat before reading, so concurrent modification only invalidates cache
+    stat_result = config_path.stat()
+    config = load_config_cache(config_path, stat_result)
+    if config is not None:
+        return config
+    with open(config_path) as f:
+        data = f.read()
+    if not data.strip():
+        return CtgrzrConfig()
+    with get_timings().phase("parse"):
+        raw_config = validate_config(load_yaml(data))
+    with get_timings().phase("deserialize"):
+        config = deserialize_config(raw_config)
+    if should_cache:
+        save_config_cache(
+            config_path,
+            config,
+            stat_result,
+            is_cwd_dependent=is_config_cwd_dependent(raw_config),
+        )
     return config
 
 
-def load_config(config_path):
+def load_config(config_path, *, should_cache=True):
     get_logger().info(f'Loading config from "{config_path}"')
     if config_path.exists():
-        with open(config_path) as f:
-            data = f.read()
-            config = yaml.safe_load(data) if data.strip() else EMPTY_CTGRZR_CONFIG
-            config = validate_config(config)
-            return deserialize_config(config)
+        return replay_config_journal(
+            config_path, load_base_config(config_path, should_cache=should_cache)
+        )
     get_logger().info("Config not specified, using default config")
     default_config_directory = to_absolute_path(Path(CTGRZR_CONFIG_DEFAULT)).parent
     if not default_config_directory.exists():
@@ -55,37 +275,72 @@ def load_config(config_path):
     validation_error = validate_writable_directory(parent_path)
     if validation_error:
         raise AppException(validation_error)
-    return dict(EMPTY_CTGRZR_CONFIG)
+    return CtgrzrConfig()
+
+
+def compact_config(config_path, config):
+    get_logger().info(f'Compacting config "{config_path}"')
+    with get_timings().phase("serialize"):
+        data = dump_yaml(serialize_config(config))
+    write_file_atomically(config_path, data)
+    save_config_cache(config_path, config, config_path.stat())
+    # Removed only after the config is replaced, replaying it again is harmless
+    get_config_journal_path(config_path).unlink(missing_ok=True)
+    config.changes.clear()
+    config.journal_size = 0
+
+
+def should_compact_config(config_path, config):
+    if not config_path.exists():
+        return True
+    journal_size = config.journal_size + len(config.changes)
+    return journal_size > max(JOURNAL_MIN_COMPACTION_SIZE, len(config.get_paths()))
 
 
 def save_config(config_path, config):
     get_logger().info("Saving config")
-    with open(config_path, "w") as f:
-        f.write(yaml.dump(serialize_config(config)))
+    if should_compact_config(config_path, config):
+        compact_config(config_path, config)
+        return
+    if not config.changes:
+        return
+    journal_path = get_config_journal_path(config_path)
+    get_logger().info(
+        f'Appending {len(config.changes)} change(s) to config journal "{journal_path}"'
+    )
+    truncate_partial_line(journal_path)
+    with open(journal_path, "a") as f:
+        f.write(
+            "".join(
+                json.dumps([operation, category, str(path)]) + "\n"
+                for operation, category, path in config.changes
+            )
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    config.journal_size += len(config.changes)
+    config.changes.clear()
 
 
 def add_path(config, path, categories, force):
-    get_logger().info(
-        f'Adding path "{path}" to config - categories -  {", ".join(categories)}'
-    )
+    logger = get_logger()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            'Adding path "%s" to config - categories -  %s', path, ", ".join(categories)
+        )
     for category in categories:
-        if category not in config:
-            config[category] = []
-        if path in config[category]:
+        if config.has_path(path, category):
             if force:
-                config[category] = [
-                    entry for entry in config[category] if entry != path
-                ]
+                config.discard(category, path)
             else:
                 raise AppException(
                     f'Path "{path}" already present in category "{category}"'
                 )
-        config[category].append(path)
+        config.add(category, path)
     return config
 
 
-def remove_path(config, path, categories, force):
-    get_logger().info(f'Removing path "{path}" from categories {", ".join(categories)}')
+def validate_categories_exist(config, categories):
     non_existing_categories = [
         category for category in categories if category not in config
     ]
@@ -93,33 +348,23 @@ def remove_path(config, path, categories, force):
         raise AppException(
             f'Categories {", ".join(non_existing_categories)} don\'t exist'
         )
+
+
+def remove_path(config, path, categories, force):
+    logger = get_logger()
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(
+            'Removing path "%s" from categories %s', path, ", ".join(categories)
+        )
+    validate_categories_exist(config, categories)
     categories = categories if categories is not None else config.keys()
     not_found_categories = [
-        category for category in categories if path not in config[category]
+        category for category in categories if not config.has_path(path, category)
     ]
     if (not force) and not_found_categories:
         raise AppException(
             f'Path "{path}" not found in categories {", ".join(categories)}'
         )
     for category in categories:
-        config[category] = [entry for entry in config[category] if entry != path]
+        config.discard(category, path)
     return config
-
-
-def transform_config_by_path(config):
-    config_entries_by_paths = [
-        (path, category) for category, paths in config.items() for path in paths
-    ]
-    config_by_path = {}
-    for path, category in config_entries_by_paths:
-        if path not in config_by_path:
-            config_by_path[path] = []
-        config_by_path[path].append(category)
-    return config_by_path
-
-
-def get_paths_from_config(config):
-    all_paths = set()
-    for category, paths in config.items():
-        all_paths |= set(paths)
-    return all_paths
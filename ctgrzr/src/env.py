@@ -1,10 +1,11 @@
-from os import environ
+from os import environ, pathsep
 from pathlib import Path
 
 from .logger import get_logger
 
 CTGRZR_CONFIG_DEFAULT = "~/.ctgrzr/config.yaml"
 CTGRZR_CONFIG_ENV = "CTGRZR_CONFIG"
+CTGRZR_EXCLUDE_ENV = "CTGRZR_EXCLUDE"
 
 
 def get_config_path_as_string(config_from_cli):
@@ -19,3 +20,12 @@ def get_config_path_as_string(config_from_cli):
 
 def resolve_config_path(config_from_cli):
     return Path(get_config_path_as_string(config_from_cli)).expanduser().resolve()
+
+
+def get_exclude_patterns(exclude_from_cli):
+    patterns = list(exclude_from_cli or [])
+    exclude_from_env = environ.get(CTGRZR_EXCLUDE_ENV)
+    if exclude_from_env:
+        patterns += [pattern for pattern in exclude_from_env.split(pathsep) if pattern]
+    get_logger().info(f'Excluding {", ".join(patterns) if patterns else "nothing"}')
+    return patterns
@@ -0,0 +1,28 @@
+import fnmatch
+import re
+
+
+def compile_globs(patterns):
+    if not patterns:
+        return None
+    # Single alternation keeps matching cost flat regardless of pattern count
+    return re.compile("|".join(f"(?:{fnmatch.translate(p)})" for p in patterns))
+
+
+class ExcludeMatcher:
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        # Patterns with separator match whole path, others only entry name
+        self.name_regex = compile_globs([p for p in self.patterns if "/" not in p])
+        self.path_regex = compile_globs([p for p in self.patterns if "/" in p])
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def is_excluded(self, name, path):
+        if self.name_regex is not None and self.name_regex.match(name):
+            return True
+        return self.path_regex is not None and self.path_regex.match(path) is not None
+
+
+NO_EXCLUDE = ExcludeMatcher([])
@@ -0,0 +1,88 @@
+import heapq
+from itertools import count
+import json
+import sys
+from threading import Lock
+
+from .logger import get_logger
+
+# Slowest operations listed per category in the end-of-run summary
+SLOWEST_OPERATIONS_COUNT = 5
+
+
+def get_usage_fields(rusage):
+    # Only subprocesses have resource usage, python operations & shell workers
+    # run inside long-lived processes
+    if rusage is None:
+        return {"max_rss_kb": None, "user_cpu": None, "system_cpu": None}
+    return {
+        "max_rss_kb": rusage.ru_maxrss,
+        "user_cpu": rusage.ru_utime,
+        "system_cpu": rusage.ru_stime,
+    }
+
+
+class ExecutionRecorder:
+    def __init__(self, records_path=None):
+        self.records_path = records_path
+        self.is_enabled = records_path is not None
+        self.file = None
+        # Min-heaps of (duration, sequence, paths), smallest is replaced first
+        self.slowest_by_category = {}
+        self.sequence = count()
+        self.lock = Lock()
+
+    def __enter__(self):
+        if self.is_enabled:
+            get_logger().info(f'Writing execution records to "{self.records_path}"')
+            self.file = open(self.records_path, "w")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self.write_summary()
+        return False
+
+    def record(self, operation, returncode, duration, rusage):
+        if not self.is_enabled:
+            return
+        line = json.dumps(
+            {
+                "category": operation.category,
+                "paths": [str(path) for path in operation.paths],
+                "command": operation.command,
+                "returncode": returncode,
+                "duration": duration,
+                **get_usage_fields(rusage),
+            }
+        )
+        entry = (duration, next(self.sequence), operation.paths)
+        with self.lock:
+            self.file.write(line + "\n")
+            slowest = self.slowest_by_category.setdefault(operation.category, [])
+            if len(slowest) < SLOWEST_OPERATIONS_COUNT:
+                heapq.heappush(slowest, entry)
+            elif entry > slowest[0]:
+                heapq.heapreplace(slowest, entry)
+
+    def get_slowest(self):
+        return {
+            category: sorted(slowest, reverse=True)
+            for category, slowest in self.slowest_by_category.items()
+        }
+
+    def write_summary(self):
+        lines = ["Slowest operations per category"]
+        for category, slowest in self.get_slowest().items():
+            lines.append(f'* Category "{category}"')
+            for duration, _, paths in slowest:
+                described_paths = str(paths[0])
+                if len(paths) > 1:
+                    described_paths += f" (+{len(paths) - 1} more)"
+                lines.append(f"  {duration:.3f}s {described_paths}")
+        sys.stderr.write("\n".join(lines) + "\n")
+
+
+NO_EXECUTION_RECORDS = ExecutionRecorder()
@@ -0,0 +1,176 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import sys
+import time
+
+from .exception import AppException
+from .execution_records import NO_EXECUTION_RECORDS
+from .logger import get_logger
+from .operation import run_process, run_python_operation
+from .progress import NO_PROGRESS
+from .shell_worker import ShellWorkerPool
+from .timings import get_timings
+
+SUBPROCESS_EXECUTOR = "subprocess"
+# Long-lived shells receiving commands over a pipe, saves shell startup per command
+COPROCESS_EXECUTOR = "coprocess"
+EXECUTORS = [SUBPROCESS_EXECUTOR, COPROCESS_EXECUTOR]
+
+
+def handle_operation_result(
+    operation, returncode, output, failed_operations, on_success, progress
+):
+    # Buffered output is written at once, so parallel jobs never interleave
+    if output:
+        sys.stdout.write(output)
+        sys.stdout.flush()
+    if returncode == 0:
+        if on_success is not None:
+            on_success(operation)
+    else:
+        get_logger().error(
+            f'Category "{operation.category}" - command "{operation.command}" failed with exit code {returncode}'
+        )
+        failed_operations.append(operation)
+    progress.update(
+        len(operation.paths), category=operation.category, failed=returncode != 0
+    )
+
+
+def run_operations_serially(operations, run_operation, *, strict, on_success, progress):
+    failed_operations = []
+    for operation in operations:
+        returncode, output = run_operation(operation)
+        handle_operation_result(
+            operation, returncode, output, failed_operations, on_success, progress
+        )
+        if strict and failed_operations:
+            break
+    return failed_operations
+
+
+def run_operations_in_pool(
+    operations, run_operation, *, strict, jobs, on_success, progress
+):
+    failed_operations = []
+    operations = iter(operations)
+    pending = {}
+    should_schedule = True
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        while True:
+            while should_schedule and len(pending) < jobs:
+                operation = next(operations, None)
+                if operation is None:
+                    should_schedule = False
+                    break
+                future = pool.submit(run_operation, operation)
+                pending[future] = operation
+            if not pending:
+                break
+            done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                operation = pending.pop(future)
+                returncode, output = future.result()
+                handle_operation_result(
+                    operation,
+                    returncode,
+                    output,
+                    failed_operations,
+                    on_success,
+                    progress,
+                )
+            if strict and failed_operations and should_schedule:
+                get_logger().warning(
+                    f"Operation failed, waiting for {len(pending)} running job(s) to finish"
+                )
+                should_schedule = False
+    return failed_operations
+
+
+# Shell commands return (returncode, output, rusage), rusage being None if the
+# command didn't run in its own process
+def run_streamed_command(command):
+    get_logger().info('Running command "%s"', command)
+    return run_process(command, should_redirect_to_stdout=True)
+
+
+def run_buffered_command(command):
+    get_logger().info('Running command "%s"', command)
+    return run_process(command, should_capture_stderr=True)
+
+
+def run_operations_with(
+    operations, run_shell_command, *, strict, jobs, on_success, progress, records
+):
+    # Python operations run in-process regardless of the executor
+    def run_operation(operation):
+        started = time.perf_counter()
+        rusage = None
+        try:
+            if operation.python_operation is not None:
+                returncode, output = run_python_operation(operation)
+            else:
+                returncode, output, rusage = run_shell_command(operation.command)
+        finally:
+            duration = time.perf_counter() - started
+            get_timings().add_operation(operation.category, duration)
+        records.record(operation, returncode, duration, rusage)
+        return returncode, output
+
+    if jobs == 1:
+        return run_operations_serially(
+            operations,
+            run_operation,
+            strict=strict,
+            on_success=on_success,
+            progress=progress,
+        )
+    return run_operations_in_pool(
+        operations,
+        run_operation,
+        strict=strict,
+        jobs=jobs,
+        on_success=on_success,
+        progress=progress,
+    )
+
+
+def run_operations(
+    operations,
+    *,
+    strict=True,
+    jobs=1,
+    on_success=None,
+    executor=SUBPROCESS_EXECUTOR,
+    progress=NO_PROGRESS,
+    records=NO_EXECUTION_RECORDS,
+):
+    if jobs < 1:
+        raise AppException(f'Invalid number of jobs "{jobs}", expected at least 1')
+    if executor not in EXECUTORS:
+        raise AppException(f'Unknown executor "{executor}"')
+    get_logger().info(f'Running operations with {jobs} job(s) using "{executor}"')
+    if executor == COPROCESS_EXECUTOR:
+        with ShellWorkerPool(jobs) as shell_workers:
+
+            def run_shell_command(command):
+                return *shell_workers.run(command), None
+
+            return run_operations_with(
+                operations,
+                run_shell_command,
+                strict=strict,
+                jobs=jobs,
+                on_success=on_success,
+                progress=progress,
+                records=records,
+            )
+    run_shell_command = run_streamed_command if jobs == 1 else run_buffered_command
+    return run_operations_with(
+        operations,
+        run_shell_command,
+        strict=strict,
+        jobs=jobs,
+        on_success=on_success,
+        progress=progress,
+        records=records,
+    )
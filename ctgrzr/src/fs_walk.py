@@ -1,25 +1,42 @@
 from enum import Enum
-from InquirerPy import inquirer
-from InquirerPy.base import Choice
 import os
 from pathlib import Path
+from queue import Empty, Queue
+from threading import Event, Thread
 
 from .ctgrzr_config import add_path
 from .exception import AppException
+from .exclude import NO_EXCLUDE
 from .logger import get_logger
+from .utils import PathKind, classify_path
 
+# Entries classified ahead of the prompt, per directory level
+WALK_PREFETCH_SIZE = 32
 
-def should_process_path(path: Path, should_include_symlinks_as_files):
-    if not os.access(path, os.R_OK):
+
+class WalkEntry:
+    def __init__(self, path, is_readable, kind, is_symlink):
+        self.path = path
+        self.is_readable = is_readable
+        self.kind = kind
+        self.is_symlink = is_symlink
+
+
+def classify_walk_path(path):
+    return WalkEntry(path, os.access(path, os.R_OK), *classify_path(path))
+
+
+def should_process_path(path: Path, should_include_symlinks_as_files, *, entry=None):
+    entry = classify_walk_path(path) if entry is None else entry
+    if not entry.is_readable:
         return False
-    is_symlink = path.is_symlink()
-    if path.is_file():
+    if entry.kind == PathKind.FILE:
         return True
-    if is_symlink:
+    if entry.is_symlink:
         if should_include_symlinks_as_files:
             return True
-        get_logger().info(f'Skipping symlink "{path}"')
-    return path.is_dir()
+        get_logger().info('Skipping symlink "%s"', path)
+    return entry.kind == PathKind.DIRECTORY
 
 
 class CallableEnum(Enum):
@@ -27,14 +44,99 @@ class CallableEnum(Enum):
         return self.value(*args, **kwargs)
 
 
-class ProcessPath:
-    def __init__(self, path):
-        self.path = path
+def iterate_paths(paths):
+    yield from paths
+
+
+def iterate_directory(path, exclude=NO_EXCLUDE):
+    # Generator, so the directory is listed lazily entry by entry, closing it
+    # releases the scandir handle
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if exclude and exclude.is_excluded(entry.name, entry.path):
+                get_logger().info('Excluding "%s"', entry.path)
+                continue
+            yield Path(entry.path)
+
+
+class WalkPrefetcher:
+    # Classifies upcoming entries in background thread while user answers the
+    # prompt, the thread owns (and closes) the underlying iterator
+    DONE = object()
+
+    def __init__(self, paths, size=WALK_PREFETCH_SIZE):
+        self.queue = Queue(maxsize=size)
+        self.stop_event = Event()
+        self.is_done = False
+        self.thread = Thread(target=self.prefetch, args=(paths,), daemon=True)
+        self.thread.start()
+
+    def prefetch(self, paths):
+        try:
+            for path in paths:
+                if self.stop_event.is_set():
+                    return
+                self.queue.put(classify_walk_path(path))
+        except Exception as e:
+            if not self.stop_event.is_set():
+                self.queue.put(e)
+        finally:
+            paths.close()
+            if not self.stop_event.is_set():
+                self.queue.put(self.DONE)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.is_done:
+            raise StopIteration
+        item = self.queue.get()
+        if item is self.DONE:
+            self.is_done = True
+            raise StopIteration
+        if isinstance(item, Exception):
+            self.is_done = True
+            raise item
+        return item
+
+    def close(self):
+        self.stop_event.set()
+        # Frees space for put the thread may be blocked on, it stops right after
+        while True:
+            try:
+                self.queue.get_nowait()
+            except Empty:
+                break
+
+
+def prefetch_paths(paths):
+    return WalkPrefetcher(iterate_paths(paths))
+
+
+def step_into(ctx, path):
+    ctx["stack"].append(
+        WalkPrefetcher(iterate_directory(path, ctx.get("exclude", NO_EXCLUDE)))
+    )
+    ctx["current_depth"] = len(ctx["stack"]) - 1
+
 
+def step_out(ctx):
+    ctx["stack"].pop().close()
+    ctx["current_depth"] = len(ctx["stack"]) - 1
 
-class DequeOperation(CallableEnum):
-    DECREMENT_DEPTH = 0
-    PROCESS_PATH = ProcessPath
+
+def get_next_path(ctx):
+    stack = ctx["stack"]
+    while stack:
+        try:
+            return next(stack[-1])
+        except StopIteration:
+            step_out(ctx)
+        except OSError as e:
+            get_logger().warning(f"Unable to list directory: {e}")
+            step_out(ctx)
+    return None
 
 
 class CategoryChoice:
@@ -52,30 +154,38 @@ class FsWalkOperation(CallableEnum):
     EXIT = 5
 
 
-def process_path(
-    ctx, *, is_multi_category=False, max_depth=None, initial_config_by_path={}
-):
+def process_path(ctx, *, is_multi_category=False, max_depth=None, initial_config=None):
+    # Prompt toolkit is slow to import, only interactive commands load it
+    from InquirerPy import inquirer
+    from InquirerPy.base import Choice
+
     get_logger().info(
-        f"Running with following options: multi = {is_multi_category}, max_depth = {max_depth}"
+        "Running with following options: multi = %s, max_depth = %s",
+        is_multi_category,
+        max_depth,
     )
     config = ctx["config"]
-    dq = ctx["dq"]
     path = ctx["path"]
     categories = ctx["categories"]
     current_depth = ctx["current_depth"]
-    if path in initial_config_by_path:
-        get_logger().info(f'Skipping path "{path}" as it already is in configuration')
+    if initial_config is not None and initial_config.has_path(path):
+        get_logger().info('Skipping path "%s" as it already is in configuration', path)
         return True, ctx
     list_choices = [
         choice
         for choice in [
             Choice(name="Skip", value=FsWalkOperation.SKIP),
-            Choice(name="Step-into", value=FsWalkOperation.STEP_INTO)
-            if path.is_dir() and (max_depth is None or current_depth < max_depth)
-            else None,
-            Choice(name="Step-out", value=FsWalkOperation.STEP_OUT)
-            if current_depth > 0
-            else None,
+            (
+                Choice(name="Step-into", value=FsWalkOperation.STEP_INTO)
+                if (ctx["is_dir"] if "is_dir" in ctx else path.is_dir())
+                and (max_depth is None or current_depth < max_depth)
+                else None
+            ),
+            (
+                Choice(name="Step-out", value=FsWalkOperation.STEP_OUT)
+                if current_depth > 0
+                else None
+            ),
             Choice(name="Exit", value=FsWalkOperation.EXIT),
         ]
         if choice is not None
@@ -113,15 +223,11 @@ def process_path(
     if action == FsWalkOperation.STEP_INTO:
         get_logger().info("Step-into action")
         if max_depth is None or current_depth < max_depth:
-            dq.appendleft(DequeOperation.DECREMENT_DEPTH)
-            for child in path.iterdir():
-                dq.appendleft(DequeOperation.PROCESS_PATH(child))
-            ctx["current_depth"] = current_depth + 1
+            step_into(ctx, path)
             return True, ctx
     if action == FsWalkOperation.STEP_OUT:
         get_logger().info("Step-out action")
-        while dq[0] != DequeOperation.DECREMENT_DEPTH:
-            dq.popleft()
+        step_out(ctx)
         return True, ctx
     if action == FsWalkOperation.PICK_CATEGORIES or isinstance(action, CategoryChoice):
         get_logger().info(f'Adding path "{path}" to categories {", ".join(categories)}')
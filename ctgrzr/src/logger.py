@@ -1,5 +1,8 @@
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import PurePosixPath
+from queue import SimpleQueue
 
 
 class LogFormatter(logging.Formatter):
@@ -19,12 +22,48 @@ class LogFormatter(logging.Formatter):
         logging.CRITICAL: bold_red + format + reset,
     }
 
+    def __init__(self):
+        super().__init__()
+        # Built once, format is called for every record
+        self.formatters = {
+            level: logging.Formatter(log_fmt) for level, log_fmt in self.FORMATS.items()
+        }
+
     def format(self, record):
-        log_fmt = self.FORMATS.get(record.levelno)
-        formatter = logging.Formatter(log_fmt)
+        formatter = self.formatters.get(record.levelno)
+        if formatter is None:
+            return super().format(record)
         return formatter.format(record)
 
 
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "file": record.filename,
+            "line": record.lineno,
+        }
+        return json.dumps(entry)
+
+
+class JsonLinesHandler(logging.FileHandler):
+    # Runs on the listener thread, file buffer is flushed on close only
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    # Default prepare merges args into message on the caller, record is queued
+    # untouched & formatted by the listener (args are paths & strings)
+    def prepare(self, record):
+        return record
+
+
 def init_logger():
     logger_ = logging.getLogger(PurePosixPath(__file__).name)
     logger_.setLevel(logging.WARNING)
@@ -44,5 +83,28 @@ def set_logging_level(level):
     logger.setLevel(level)
 
 
+def enable_json_logging(log_path, level=logging.INFO):
+    # Records are only queued by the caller, message formatting, encoding &
+    # writing happens on the listener thread
+    file_handler = JsonLinesHandler(log_path, encoding="utf-8")
+    file_handler.setFormatter(JsonLinesFormatter())
+    log_queue = SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.setLevel(level)
+    listener = QueueListener(log_queue, file_handler)
+    listener.start()
+    logger.addHandler(queue_handler)
+    previous_level = logger.level
+    logger.setLevel(min(previous_level, level))
+
+    def disable_json_logging():
+        logger.removeHandler(queue_handler)
+        logger.setLevel(previous_level)
+        listener.stop()
+        file_handler.close()
+
+    return disable_json_logging
+
+
 def get_logger():
     return logger
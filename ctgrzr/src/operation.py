@@ -1,11 +1,13 @@
-import yaml
+from importlib import import_module
 import os
+import shlex
 import sys
 from pathlib import Path
-from subprocess import run, PIPE
+from subprocess import CalledProcessError, Popen, PIPE, STDOUT
 
 from .exception import AppException
 from .logger import get_logger
+from .utils import load_yaml
 
 
 def validate_operations_config(operations_config):
@@ -15,18 +17,97 @@ def validate_operations_config(operations_config):
             f'Operations config, expected minimum "{MINIMAL_OPERATIONS_CONFIG_SIZE}" keys in the config'
         )
     for category, command in operations_config.items():
+        if isinstance(command, dict):
+            operations_config[category] = parse_python_operation(category, command)
+            continue
+        if not isinstance(command, str):
+            raise AppException(
+                f'Operations config - category "{category}" - '
+                + f'expected command or python operation, got "{command}"'
+            )
         if "{}" not in command:
             raise AppException(
                 f'Operations config - category "{category}"'
                 + 'Expected templated command with "{}" '
                 + f'got "{command}"'
             )
+        if BATCH_PLACEHOLDER in command and (
+            command.count(BATCH_PLACEHOLDER) > 1
+            or command.count(PLACEHOLDER) != command.count(BATCH_PLACEHOLDER)
+        ):
+            raise AppException(
+                f'Operations config - category "{category}" - '
+                + f'batched command has to contain exactly one "{BATCH_PLACEHOLDER}" '
+                + f'and no other placeholders, got "{command}"'
+            )
     return operations_config
 
 
+def resolve_python_callable(spec):
+    module_name, _, attribute_name = spec.partition(":")
+    if not module_name or not attribute_name:
+        raise AppException(
+            f'Invalid python operation "{spec}", expected "module:callable"'
+        )
+    try:
+        function = import_module(module_name)
+        for attribute in attribute_name.split("."):
+            function = getattr(function, attribute)
+    except (ImportError, AttributeError) as e:
+        raise AppException(f'Unable to load python operation "{spec}": {e}')
+    if not callable(function):
+        raise AppException(f'Python operation "{spec}" is not callable')
+    return function
+
+
+class PythonOperation:
+    def __init__(self, spec, *, batch=False):
+        self.spec = spec
+        self.batch = batch
+        self.function = resolve_python_callable(spec)
+
+    def __str__(self):
+        return f"python: {self.spec}"
+
+    def __call__(self, paths):
+        # Batched operations receive list of paths, others a single path
+        result = self.function(paths) if self.batch else self.function(paths[0])
+        if isinstance(result, bool):
+            return 0 if result else 1
+        if isinstance(result, int):
+            return result
+        return 0
+
+
+def parse_python_operation(category, operation_definition):
+    spec = operation_definition.get("python")
+    batch = operation_definition.get("batch", False)
+    redundant_keys = set(operation_definition.keys()) - {"python", "batch"}
+    if not isinstance(spec, str) or redundant_keys:
+        raise AppException(
+            f'Operations config - category "{category}" - '
+            + f'expected "python: module:callable" entry, got "{operation_definition}"'
+        )
+    if not (isinstance(batch, bool) or (isinstance(batch, int) and batch > 0)):
+        raise AppException(
+            f'Operations config - category "{category}" - '
+            + f'"batch" has to be boolean or positive number, got "{batch}"'
+        )
+    return PythonOperation(spec, batch=batch)
+
+
 # This assumes that I'm distinguishing at least between 2 buckets
 MINIMAL_OPERATIONS_CONFIG_SIZE = 2
 
+PLACEHOLDER = "{}"
+# Expands into as many (quoted) paths as fit into a single command line
+BATCH_PLACEHOLDER = "{}+"
+# Same safety margin as xargs keeps below ARG_MAX
+BATCH_COMMAND_HEADROOM = 2048
+# Linux caps every single argument (and "sh -c" passes the command as one)
+# to 32 pages, regardless of ARG_MAX
+MAX_ARG_STRLEN = 32 * 4096
+
 
 def load_operations_config(operations_path, *, validate_expected_keys=None):
     get_logger().info(f'Loading operations config from "{operations_path}"')
@@ -37,7 +118,7 @@ def load_operations_config(operations_path, *, validate_expected_keys=None):
         raise AppException(f'Operations config "{operations_path}" is not readable')
     with open(operations_path) as f:
         data = f.read()
-        operations_config = yaml.safe_load(data)
+        operations_config = load_yaml(data)
         operations_config = validate_operations_config(operations_config)
     if operations_config is None:
         raise AppException("Unable to load config")
@@ -63,13 +144,144 @@ def load_operations_config(operations_path, *, validate_expected_keys=None):
     return operations_config
 
 
-def run_command(command, *, should_redirect_to_stdout=False, check=False):
-    get_logger().info(
-        f'Running command "{command}" - {"exit" if check  else "continue"} on failure'
+class Operation:
+    def __init__(self, category, paths, command, *, python_operation=None, index=None):
+        self.category = category
+        self.paths = paths
+        # Python operations keep their description as command for reporting
+        self.command = command
+        self.python_operation = python_operation
+        self.index = index
+
+
+def get_batch_command_limit():
+    arg_max = os.sysconf("SC_ARG_MAX")
+    environment_size = sum(
+        len(os.fsencode(key)) + len(os.fsencode(value)) + 2
+        for key, value in os.environ.items()
     )
+    limit = arg_max - environment_size - BATCH_COMMAND_HEADROOM
+    if sys.platform.startswith("linux"):
+        limit = min(limit, MAX_ARG_STRLEN - 1)
+    return limit
+
+
+def expand_batch_operations(category, paths, command_template, limit):
+    template_size = len(os.fsencode(command_template)) - len(BATCH_PLACEHOLDER)
+    batch = []
+    batch_arguments = []
+    batch_size = template_size
+    for path in paths:
+        argument = shlex.quote(str(path))
+        argument_size = len(os.fsencode(argument)) + 1
+        if template_size + argument_size > limit:
+            raise AppException(
+                f'Category "{category}" - path "{path}" does not fit into command line'
+            )
+        if batch and batch_size + argument_size > limit:
+            yield Operation(
+                category,
+                batch,
+                command_template.replace(BATCH_PLACEHOLDER, " ".join(batch_arguments)),
+            )
+            batch = []
+            batch_arguments = []
+            batch_size = template_size
+        batch.append(path)
+        batch_arguments.append(argument)
+        batch_size += argument_size
+    if batch:
+        yield Operation(
+            category,
+            batch,
+            command_template.replace(BATCH_PLACEHOLDER, " ".join(batch_arguments)),
+        )
+
+
+def expand_python_operations(category, paths, python_operation):
+    if python_operation.batch is False:
+        batches = ([path] for path in paths)
+    elif python_operation.batch is True:
+        batches = [list(paths)] if paths else []
+    else:
+        paths = list(paths)
+        batches = (
+            paths[i : i + python_operation.batch]
+            for i in range(0, len(paths), python_operation.batch)
+        )
+    for batch in batches:
+        yield Operation(
+            category, batch, str(python_operation), python_operation=python_operation
+        )
+
+
+def expand_operations(config, operations_config):
+    batch_command_limit = None
+    for category, paths in config.items():
+        command_template = operations_config[category]
+        if isinstance(command_template, PythonOperation):
+            yield from expand_python_operations(category, paths, command_template)
+            continue
+        if BATCH_PLACEHOLDER in command_template:
+            if batch_command_limit is None:
+                batch_command_limit = get_batch_command_limit()
+            yield from expand_batch_operations(
+                category, paths, command_template, batch_command_limit
+            )
+            continue
+        for path in paths:
+            yield Operation(
+                category, [path], command_template.replace(PLACEHOLDER, str(path))
+            )
+
+
+def run_process(
+    command, *, should_redirect_to_stdout=False, should_capture_stderr=False
+):
     stdout = sys.stdout if should_redirect_to_stdout else PIPE
-    completed_process = run(command, shell=True, stdout=stdout, check=check)
-    process_output = (
-        None if should_redirect_to_stdout else completed_process.stdout.decode("utf-8")
+    stderr = STDOUT if should_capture_stderr and not should_redirect_to_stdout else None
+    process = Popen(command, shell=True, stdout=stdout, stderr=stderr)
+    output = None
+    try:
+        if process.stdout is not None:
+            with process.stdout:
+                output = process.stdout.read()
+    finally:
+        # Reaped directly, Popen.wait doesn't expose resource usage of the child
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    # Output of arbitrary commands doesn't have to be valid UTF-8
+    process_output = None if output is None else output.decode("utf-8", "replace")
+    return process.returncode, process_output, rusage
+
+
+def run_command(
+    command,
+    *,
+    should_redirect_to_stdout=False,
+    should_capture_stderr=False,
+    check=False,
+):
+    get_logger().info(
+        'Running command "%s" - %s on failure', command, "exit" if check else "continue"
+    )
+    returncode, process_output, _ = run_process(
+        command,
+        should_redirect_to_stdout=should_redirect_to_stdout,
+        should_capture_stderr=should_capture_stderr,
+    )
+    if check and returncode != 0:
+        raise CalledProcessError(returncode, command, process_output)
+    return (returncode, process_output)
+
+
+def run_python_operation(operation):
+    get_logger().info(
+        'Running python operation "%s" on %d path(s)',
+        operation.python_operation.spec,
+        len(operation.paths),
     )
-    return (completed_process.returncode, process_output)
+    try:
+        return operation.python_operation(operation.paths), None
+    except Exception as e:
+        return 1, f"{type(e).__name__}: {e}\n"
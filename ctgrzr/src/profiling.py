@@ -0,0 +1,22 @@
+import sys
+
+
+def profile_call(function, profile_path, *, should_trace_memory=False):
+    # Imported here, profiling modules are useless for regular runs
+    import cProfile
+
+    if should_trace_memory:
+        import tracemalloc
+
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function()
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        if should_trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            sys.stderr.write(f"Peak traced memory: {peak / (1 << 20):.1f} MiB\n")
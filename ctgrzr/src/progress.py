@@ -0,0 +1,128 @@
+import json
+import sys
+from threading import Lock
+import time
+
+from .logger import get_logger
+from .utils import write_file_atomically
+
+# Seconds between reports, terminal line is cheap to redraw, log lines are not
+PROGRESS_TTY_INTERVAL = 0.2
+PROGRESS_LOG_INTERVAL = 5.0
+PROGRESS_STATUS_INTERVAL = 1.0
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+
+class ProgressReporter:
+    def __init__(self, *, should_render=False, status_path=None, stream=None):
+        self.stream = sys.stderr if stream is None else stream
+        self.should_render = should_render
+        self.status_path = status_path
+        self.is_enabled = should_render or status_path is not None
+        self.is_tty = should_render and self.stream.isatty()
+        if self.is_tty:
+            self.interval = PROGRESS_TTY_INTERVAL
+        elif should_render:
+            self.interval = PROGRESS_LOG_INTERVAL
+        else:
+            self.interval = PROGRESS_STATUS_INTERVAL
+        # Walks of parallel jobs report from their worker threads
+        self.lock = Lock()
+        self.start(None)
+
+    def start(self, label, total=None):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.failures = 0
+        self.found = 0
+        self.category = None
+        self.started = time.monotonic()
+        self.next_report = self.started + self.interval
+
+    def update(self, count=1, *, category=None, failed=False, found=0):
+        # Called per item, everything but counters is deferred to the report
+        if not self.is_enabled:
+            return
+        with self.lock:
+            self.done += count
+            self.found += found
+            if failed:
+                self.failures += 1
+            if category is not None:
+                self.category = category
+            now = time.monotonic()
+            if now >= self.next_report:
+                self.next_report = now + self.interval
+                self.report(now)
+
+    def get_status(self, now, *, is_finished=False):
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(self.total - self.done, 0) / rate
+        return {
+            "command": self.label,
+            "done": self.done,
+            "total": self.total,
+            "rate": rate,
+            "elapsed": elapsed,
+            "eta": eta,
+            "category": self.category,
+            "failures": self.failures,
+            "found": self.found,
+            "finished": is_finished,
+        }
+
+    def format_status(self, status):
+        parts = [f'{status["command"]}: {status["done"]}']
+        if status["total"] is not None:
+            percent = 100 * status["done"] / status["total"] if status["total"] else 100
+            parts[0] += f'/{status["total"]} ({percent:.0f}%)'
+        parts.append(f'{status["rate"]:.1f}/s')
+        if status["eta"] is not None and not status["finished"]:
+            parts.append(f'ETA {format_duration(status["eta"])}')
+        else:
+            parts.append(f'elapsed {format_duration(status["elapsed"])}')
+        if status["category"] is not None:
+            parts.append(f'category "{status["category"]}"')
+        if status["found"]:
+            parts.append(f'{status["found"]} found')
+        parts.append(f'{status["failures"]} failure(s)')
+        return " - ".join(parts)
+
+    def report(self, now, *, is_finished=False):
+        status = self.get_status(now, is_finished=is_finished)
+        if self.should_render:
+            line = self.format_status(status)
+            if self.is_tty:
+                # Redraws the line in place, clearing leftovers of longer one
+                self.stream.write(f"\r{line}\x1b[K" + ("\n" if is_finished else ""))
+            else:
+                self.stream.write(line + "\n")
+            self.stream.flush()
+        if self.status_path is not None:
+            try:
+                write_file_atomically(self.status_path, json.dumps(status))
+            except OSError as e:
+                get_logger().warning(
+                    f'Unable to write progress status "{self.status_path}": {e}'
+                )
+                self.status_path = None
+
+    def finish(self):
+        if self.is_enabled:
+            with self.lock:
+                self.report(time.monotonic(), is_finished=True)
+
+
+NO_PROGRESS = ProgressReporter()
@@ -0,0 +1,75 @@
+import marshal
+import time
+
+from .logger import get_logger
+from .utils import write_file_atomically
+
+SCAN_CACHE_VERSION = 1
+# Directory modified this close to the scan can change again within the same
+# mtime tick, such listing isn't trusted on the next run
+SCAN_CACHE_RACY_INTERVAL_NS = 2 * 10**9
+
+
+def get_scan_cache_path(config_path):
+    return config_path.with_name(f"{config_path.name}.scan-cache")
+
+
+class ScanCache:
+    def __init__(self, directories=None):
+        # directory -> [mtime, inode, symlink names, subdirectory names]
+        self.directories = directories or {}
+        self.visited_directories = {}
+        self.started_ns = time.time_ns()
+        self.hits = 0
+
+    def get(self, directory, directory_stat):
+        entry = self.directories.get(directory)
+        if (
+            entry is None
+            or entry[0] != directory_stat.st_mtime_ns
+            or entry[1] != directory_stat.st_ino
+        ):
+            return None
+        self.hits += 1
+        self.visited_directories[directory] = entry
+        return entry[2], entry[3]
+
+    def put(self, directory, directory_stat, symlink_names, subdirectory_names):
+        if directory_stat.st_mtime_ns >= self.started_ns - SCAN_CACHE_RACY_INTERVAL_NS:
+            return
+        self.visited_directories[directory] = [
+            directory_stat.st_mtime_ns,
+            directory_stat.st_ino,
+            symlink_names,
+            subdirectory_names,
+        ]
+
+
+def load_scan_cache(scan_cache_path):
+    get_logger().info(f'Loading scan cache from "{scan_cache_path}"')
+    try:
+        with open(scan_cache_path, "rb") as f:
+            version, directories = marshal.load(f)
+    except FileNotFoundError:
+        return ScanCache()
+    except (OSError, EOFError, ValueError, TypeError):
+        get_logger().warning(f'Scan cache "{scan_cache_path}" is corrupted, ignoring')
+        return ScanCache()
+    if version != SCAN_CACHE_VERSION:
+        get_logger().warning(
+            f'Scan cache "{scan_cache_path}" has unsupported version, ignoring'
+        )
+        return ScanCache()
+    return ScanCache(directories)
+
+
+def save_scan_cache(scan_cache_path, scan_cache):
+    get_logger().info(
+        f"Saving scan cache, {scan_cache.hits} directories were unchanged"
+    )
+    # Only directories visited by this scan are kept, so removed ones expire
+    data = marshal.dumps([SCAN_CACHE_VERSION, scan_cache.visited_directories])
+    try:
+        write_file_atomically(scan_cache_path, data, mode="wb")
+    except OSError as e:
+        get_logger().warning(f'Unable to write scan cache "{scan_cache_path}": {e}')
@@ -0,0 +1,96 @@
+import os
+from queue import SimpleQueue
+import secrets
+import shlex
+from subprocess import Popen, PIPE, STDOUT
+
+from .logger import get_logger
+
+SHELL_WORKER_EXECUTABLE = "/bin/sh"
+# Exit code reported when the worker shell itself dies (e.g. on a syntax error)
+SHELL_WORKER_DIED_EXIT_CODE = 2
+
+
+class ShellWorker:
+    def __init__(self):
+        self.sentinel = f"__ctgrzr_done_{secrets.token_hex(8)}__".encode("ascii")
+        self.process = Popen(
+            [SHELL_WORKER_EXECUTABLE], stdin=PIPE, stdout=PIPE, stderr=STDOUT
+        )
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def run(self, command):
+        get_logger().info('Running command "%s" in shell worker', command)
+        # Command is passed quoted to "eval", so syntax errors can't desync the
+        # protocol, subshell isolates "cd", "exit" & variables and stdin must not
+        # consume the protocol
+        script = (
+            f"( eval {shlex.quote(command)} ) </dev/null; "
+            + f"printf '\\n%s %d\\n' '{self.sentinel.decode('ascii')}' $?\n"
+        )
+        try:
+            # Undecodable path bytes are kept, same as Popen does for shell=True
+            self.process.stdin.write(os.fsencode(script))
+            self.process.stdin.flush()
+        except BrokenPipeError:
+            return self.handle_died_worker([])
+        lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                return self.handle_died_worker(lines)
+            if line.startswith(self.sentinel + b" "):
+                break
+            lines.append(line)
+        returncode = int(line[len(self.sentinel) + 1 :])
+        # Drop the newline printed in front of the sentinel
+        output = b"".join(lines)[:-1]
+        return returncode, output.decode("utf-8", errors="replace")
+
+    def handle_died_worker(self, lines):
+        returncode = self.process.wait() or SHELL_WORKER_DIED_EXIT_CODE
+        get_logger().warning(f"Shell worker died with exit code {returncode}")
+        return returncode, b"".join(lines).decode("utf-8", errors="replace")
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.process.wait()
+        self.process.stdout.close()
+
+
+class ShellWorkerPool:
+    def __init__(self, size):
+        self.size = size
+        self.workers = SimpleQueue()
+        self.all_workers = []
+
+    def __enter__(self):
+        get_logger().info(f"Starting {self.size} shell worker(s)")
+        for _ in range(self.size):
+            self.add_worker()
+        return self
+
+    def __exit__(self, *args):
+        for worker in self.all_workers:
+            worker.close()
+
+    def add_worker(self):
+        worker = ShellWorker()
+        self.all_workers.append(worker)
+        self.workers.put(worker)
+
+    def run(self, command):
+        worker = self.workers.get()
+        try:
+            returncode, output = worker.run(command)
+        finally:
+            if worker.is_alive():
+                self.workers.put(worker)
+            else:
+                self.add_worker()
+        return returncode, output
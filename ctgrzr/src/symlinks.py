@@ -1,23 +1,277 @@
-from collections import deque
+import os
+from pathlib import Path
+import stat
+from threading import Lock
 
+from .exclude import NO_EXCLUDE
 from .logger import get_logger
+from .progress import NO_PROGRESS
+from .utils import PathKind, classify_path, map_concurrently
 
 
-def search_symlinks_in_directory(root):
-    get_logger().info(f'Checking for symlinks in "{root}"')
-    dq = deque([root])
-    while dq:
-        path = dq.popleft()
-        if path.is_dir():
-            for child in path.iterdir():
-                dq.appendleft(child)
-        if path.is_symlink():
-            yield path
+class SymlinkMatch:
+    def __init__(self, path, roots, target, is_target_outside):
+        self.path = path
+        # All searched paths (config entries) containing the symlink
+        self.roots = roots
+        self.target = target
+        self.is_target_outside = is_target_outside
 
 
-def search_symlinks_in_directories(paths):
+class VisitedDirectories:
+    def __init__(self):
+        # (st_dev, st_ino) packed into single int, shared by concurrent walks
+        self.inodes = set()
+        self.lock = Lock()
+
+    def add(self, stat_result):
+        inode = (stat_result.st_dev << 64) | stat_result.st_ino
+        with self.lock:
+            if inode in self.inodes:
+                return False
+            self.inodes.add(inode)
+            return True
+
+
+def list_directory(directory, directory_stat, scan_cache):
+    if scan_cache is not None:
+        listing = scan_cache.get(directory, directory_stat)
+        if listing is not None:
+            return listing
+    symlink_names = []
+    subdirectory_names = []
+    # DirEntry types come from readdir, so entries need no stat
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_symlink():
+                symlink_names.append(entry.name)
+            elif entry.is_dir(follow_symlinks=False):
+                subdirectory_names.append(entry.name)
+    if scan_cache is not None:
+        scan_cache.put(directory, directory_stat, symlink_names, subdirectory_names)
+    return symlink_names, subdirectory_names
+
+
+def search_symlinks_in_directory(
+    root,
+    *,
+    visited=None,
+    one_file_system=False,
+    exclude=NO_EXCLUDE,
+    max_depth=None,
+    scan_cache=None,
+    progress=NO_PROGRESS,
+):
+    get_logger().info('Checking for symlinks in "%s"', root)
+    visited = VisitedDirectories() if visited is None else visited
+    try:
+        root_stat = os.lstat(root)
+    except OSError as e:
+        get_logger().warning(f'Unable to access directory "{root}": {e}')
+        return
+    # Only directories are stat-ed (for cycle detection & scan cache), directory
+    # symlinks are reported, not followed
+    stack = [(str(root), root_stat, 0)]
+    while stack:
+        directory, directory_stat, depth = stack.pop()
+        if not visited.add(directory_stat):
+            get_logger().info('Skipping already visited directory "%s"', directory)
+            continue
+        try:
+            symlink_names, subdirectory_names = list_directory(
+                directory, directory_stat, scan_cache
+            )
+        except OSError as e:
+            get_logger().warning(f'Unable to list directory "{directory}": {e}')
+            progress.update(failed=True)
+            continue
+        found_symlinks = 0
+        for name in symlink_names:
+            path = os.path.join(directory, name)
+            if not (exclude and exclude.is_excluded(name, path)):
+                found_symlinks += 1
+                yield Path(path)
+        progress.update(found=found_symlinks)
+        if max_depth is not None and depth + 1 >= max_depth:
+            continue
+        for name in subdirectory_names:
+            path = os.path.join(directory, name)
+            # Excluded subtrees are cut before they are ever listed
+            if exclude and exclude.is_excluded(name, path):
+                continue
+            try:
+                child_stat = os.lstat(path)
+            except OSError:
+                continue
+            # Cached listing can be outdated for entries replaced in place
+            if not stat.S_ISDIR(child_stat.st_mode):
+                continue
+            if one_file_system and child_stat.st_dev != root_stat.st_dev:
+                get_logger().info('Skipping "%s" on other filesystem', path)
+                continue
+            stack.append((path, child_stat, depth + 1))
+
+
+def get_root_prefix(root):
+    root = str(root)
+    return root if root.endswith(os.sep) else root + os.sep
+
+
+def is_reachable_from_root(
+    root, nested_root, *, one_file_system=False, exclude=NO_EXCLUDE, max_depth=None
+):
+    # Walk doesn't follow symlinks, nested root behind a symlink isn't covered
+    nested_parent = os.path.dirname(str(nested_root))
+    expected_parent = os.path.normpath(
+        os.path.join(os.path.realpath(root), os.path.relpath(nested_parent, root))
+    )
+    if os.path.realpath(nested_parent) != expected_parent:
+        return False
+    # Same checks as the walk makes on its way down to the nested root
+    names = Path(os.path.relpath(nested_root, root)).parts
+    if max_depth is not None and len(names) >= max_depth:
+        return False
+    path = str(root)
+    try:
+        root_device = os.lstat(path).st_dev if one_file_system else None
+        for name in names:
+            path = os.path.join(path, name)
+            if exclude and exclude.is_excluded(name, path):
+                return False
+            if one_file_system and os.lstat(path).st_dev != root_device:
+                return False
+    except OSError:
+        return False
+    return True
+
+
+def collapse_roots(
+    roots,
+    symlink_roots=frozenset(),
+    *,
+    one_file_system=False,
+    exclude=NO_EXCLUDE,
+    max_depth=None,
+):
+    # Sorted with trailing separator, descendants directly follow their root,
+    # stack holds the kept roots containing the current one
+    collapsed_roots = []
+    ancestor_roots = []
+    for root in sorted(roots, key=get_root_prefix):
+        root_prefix = get_root_prefix(root)
+        while ancestor_roots and not root_prefix.startswith(
+            get_root_prefix(ancestor_roots[-1])
+        ):
+            ancestor_roots.pop()
+        # Symlink roots are reported, never walked, so they can't cover anything
+        containing_root = next(
+            (
+                ancestor_root
+                for ancestor_root in ancestor_roots
+                if ancestor_root not in symlink_roots
+                and is_reachable_from_root(
+                    ancestor_root,
+                    root,
+                    one_file_system=one_file_system,
+                    exclude=exclude,
+                    max_depth=max_depth,
+                )
+            ),
+            None,
+        )
+        if containing_root is not None:
+            get_logger().info(
+                f'Path "{root}" is searched as part of "{containing_root}"'
+            )
+            continue
+        collapsed_roots.append(root)
+        ancestor_roots.append(root)
+    return collapsed_roots
+
+
+def get_containing_roots(path, root_strings):
+    containing_roots = []
+    path = str(path)
+    while True:
+        if path in root_strings:
+            containing_roots.append(Path(path))
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return containing_roots[::-1]
+
+
+def search_symlinks_in_directories(
+    paths,
+    *,
+    jobs=1,
+    one_file_system=False,
+    exclude=NO_EXCLUDE,
+    max_depth=None,
+    scan_cache=None,
+    progress=NO_PROGRESS,
+):
+    root_strings = set()
+    # Symlink targets are checked against all paths, including files
+    categorized_strings = set()
+    symlink_roots = set()
+    roots = []
     for path in paths:
-        if path.is_symlink():
-            yield path
-        if path.is_dir():
-            yield from search_symlinks_in_directory(path)
+        categorized_strings.add(str(path))
+        path_kind, is_symlink = classify_path(path)
+        if is_symlink:
+            symlink_roots.add(path)
+        elif path_kind != PathKind.DIRECTORY:
+            continue
+        root_strings.add(str(path))
+        roots.append(path)
+    directories = []
+    symlinks = []
+    # Directories that are nested in other searched directories aren't walked
+    # again, their symlinks are attributed to all containing roots instead
+    for root in collapse_roots(
+        roots,
+        symlink_roots,
+        one_file_system=one_file_system,
+        exclude=exclude,
+        max_depth=max_depth,
+    ):
+        if root in symlink_roots:
+            symlinks.append(root)
+        else:
+            directories.append(root)
+            categorized_strings.add(os.path.realpath(root))
+
+    def create_symlink_match(symlink):
+        target = Path(os.path.realpath(symlink))
+        return SymlinkMatch(
+            symlink,
+            get_containing_roots(symlink, root_strings),
+            target,
+            not get_containing_roots(target, categorized_strings),
+        )
+
+    yield from map(create_symlink_match, symlinks)
+    visited = VisitedDirectories()
+
+    def search_symlinks_in_root(root):
+        return search_symlinks_in_directory(
+            root,
+            visited=visited,
+            one_file_system=one_file_system,
+            exclude=exclude,
+            max_depth=max_depth,
+            scan_cache=scan_cache,
+            progress=progress,
+        )
+
+    if jobs == 1:
+        for root in directories:
+            yield from map(create_symlink_match, search_symlinks_in_root(root))
+        return
+    # Workers walk ahead, their matches are handed over once a root is done
+    for symlinks in map_concurrently(
+        lambda root: list(search_symlinks_in_root(root)), directories, jobs=jobs
+    ):
+        yield from map(create_symlink_match, symlinks)
@@ -0,0 +1,81 @@
+from contextlib import contextmanager
+import json
+import os
+import sys
+from threading import Lock
+import time
+
+
+def get_clock():
+    # Children CPU is only accounted after they are waited for
+    times = os.times()
+    return (
+        time.perf_counter(),
+        time.process_time(),
+        times.children_user + times.children_system,
+    )
+
+
+class Timings:
+    def __init__(self):
+        self.phases = {}
+        self.categories = {}
+        self.lock = Lock()
+
+    def reset(self):
+        with self.lock:
+            self.phases.clear()
+            self.categories.clear()
+
+    def start(self):
+        return get_clock()
+
+    def record(self, name, started):
+        wall, cpu, children_cpu = (
+            now - start for now, start in zip(get_clock(), started)
+        )
+        with self.lock:
+            phase = self.phases.setdefault(
+                name, {"wall": 0.0, "cpu": 0.0, "children_cpu": 0.0, "count": 0}
+            )
+            phase["wall"] += wall
+            phase["cpu"] += cpu
+            phase["children_cpu"] += children_cpu
+            phase["count"] += 1
+
+    @contextmanager
+    def phase(self, name):
+        started = self.start()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def add_operation(self, category, wall):
+        # Operations of parallel jobs overlap, totals can exceed the wall time
+        with self.lock:
+            totals = self.categories.setdefault(
+                category, {"wall": 0.0, "operations": 0}
+            )
+            totals["wall"] += wall
+            totals["operations"] += 1
+
+    def to_dict(self):
+        with self.lock:
+            return {"phases": dict(self.phases), "categories": dict(self.categories)}
+
+
+timings = Timings()
+
+
+def get_timings():
+    return timings
+
+
+def write_timings(output_path):
+    data = json.dumps(get_timings().to_dict(), indent=2)
+    if output_path == "-":
+        sys.stderr.write(data + "\n")
+        return
+    with open(output_path, "w") as f:
+        f.write(data + "\n")
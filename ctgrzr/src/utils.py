@@ -1,12 +1,112 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 import os
+from pathlib import Path
+import stat
 
+from .exception import AppException
 from .logger import get_logger
 
 
+def load_yaml(data):
+    # Imported on first use, commands served from config cache never need it
+    import yaml
+
+    # libyaml bindings are an order of magnitude faster, but optional
+    if hasattr(yaml, "CSafeLoader"):
+        try:
+            return yaml.load(data, Loader=yaml.CSafeLoader)
+        except yaml.YAMLError:
+            # Rejects escaped surrogates of undecodable filenames (or the data
+            # is broken & the pure-Python loader reports it the same way)
+            pass
+    return yaml.load(data, Loader=yaml.SafeLoader)
+
+
+def dump_yaml(data):
+    import yaml
+
+    # libyaml emitter can't encode surrogates of undecodable filenames, config
+    # is dumped on compaction only, so the pure-Python one is kept
+    return yaml.dump(data, Dumper=yaml.Dumper)
+
+
+STREAM_CHUNK_SIZE = 1 << 16
+
+
+class PathKind(Enum):
+    MISSING = 0
+    FILE = 1
+    DIRECTORY = 2
+    OTHER = 3
+
+
+def get_path_kind(mode):
+    if stat.S_ISREG(mode):
+        return PathKind.FILE
+    if stat.S_ISDIR(mode):
+        return PathKind.DIRECTORY
+    return PathKind.OTHER
+
+
+def classify_path(path):
+    # Single lstat, symlinks need 2nd stat to classify their target
+    try:
+        stat_result = os.lstat(path)
+    except OSError:
+        return PathKind.MISSING, False
+    if not stat.S_ISLNK(stat_result.st_mode):
+        return get_path_kind(stat_result.st_mode), False
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return PathKind.MISSING, True
+    return get_path_kind(stat_result.st_mode), True
+
+
+def map_concurrently(function, items, *, jobs=1):
+    if jobs < 1:
+        raise AppException(f'Invalid number of jobs "{jobs}", expected at least 1')
+    if jobs == 1:
+        yield from map(function, items)
+        return
+    # Bounded window of futures keeps memory flat & results ordered
+    window_size = jobs * 4
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = deque()
+        for item in items:
+            futures.append(pool.submit(function, item))
+            if len(futures) >= window_size:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def classify_paths(paths, *, jobs=1):
+    paths = list(paths)
+    return zip(paths, map_concurrently(classify_path, paths, jobs=jobs))
+
+
 def to_absolute_path(p):
     return p.expanduser().absolute()
 
 
+def read_paths_from_stream(stream, separator):
+    remainder = b""
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        entries = (remainder + chunk).split(separator)
+        remainder = entries.pop()
+        for entry in entries:
+            if entry:
+                yield to_absolute_path(Path(os.fsdecode(entry)))
+    if remainder:
+        yield to_absolute_path(Path(os.fsdecode(remainder)))
+
+
 def validate_writable_directory(directory_path):
     get_logger().info(f'Validating if "{directory_path}" is writable')
     if not directory_path.exists():
@@ -15,3 +115,40 @@ def validate_writable_directory(directory_path):
         return f'Parent path "{directory_path}" is not a directory'
     if not os.access(directory_path, os.W_OK):
         return f'No writable permissions in the "{directory_path}" directory'
+
+
+def truncate_partial_line(file_path):
+    # Line-oriented journals are appended to, a crash can leave partial last
+    # line which would otherwise get glued to the next entry
+    try:
+        f = open(file_path, "rb+")
+    except FileNotFoundError:
+        return
+    with f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - STREAM_CHUNK_SIZE)
+            f.seek(start)
+            chunk = f.read(end - start)
+            newline_index = chunk.rfind(b"\n")
+            if newline_index != -1:
+                end = start + newline_index + 1
+                break
+            end = start
+        if end != size:
+            get_logger().warning(
+                f'Removing truncated entry from the end of "{file_path}"'
+            )
+            f.truncate(end)
+
+
+def write_file_atomically(file_path, data, *, mode="w"):
+    temporary_path = file_path.with_name(f".{file_path.name}.tmp")
+    with open(temporary_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if file_path.exists():
+        os.chmod(temporary_path, file_path.stat().st_mode)
+    os.replace(temporary_path, file_path)
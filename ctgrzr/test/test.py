@@ -1,19 +1,60 @@
 #!/usr/bin/python3
 import unittest
+from unittest import mock
+import io
+import json
 import os
+import subprocess
+import sys
 import logging
 from pathlib import Path
 
 import yaml
+from ctgrzr.src.apply_plan import get_apply_journal_path
+from ctgrzr.src.apply_state import get_apply_state_path
 from ctgrzr.src.cli import cli, get_arg_parser
-from ctgrzr.src.ctgrzr_config import load_config
+from ctgrzr.src.classify_rules import load_classify_rules
+from ctgrzr.src.ctgrzr_config import (
+    CtgrzrConfig,
+    add_path,
+    get_config_cache_path,
+    get_config_journal_path,
+    load_config,
+    remove_path,
+)
+from ctgrzr.src.exception import AppException
+from ctgrzr.src.exclude import ExcludeMatcher
 from ctgrzr.src.env import get_config_path_as_string, resolve_config_path
-from ctgrzr.src.logger import get_logger, set_logging_level
-from ctgrzr.src.operation import run_command
-from ctgrzr.src.symlinks import search_symlinks_in_directory
+from ctgrzr.src.fs_walk import (
+    get_next_path,
+    prefetch_paths,
+    should_process_path,
+    step_into,
+    step_out,
+)
+from ctgrzr.src.logger import enable_json_logging, get_logger, set_logging_level
+from ctgrzr.src.operation import expand_batch_operations, run_command
+from ctgrzr.src.progress import ProgressReporter
+from ctgrzr.src.scan_cache import SCAN_CACHE_RACY_INTERVAL_NS, ScanCache
+from ctgrzr.src.shell_worker import ShellWorkerPool
+from ctgrzr.src.symlinks import (
+    collapse_roots,
+    search_symlinks_in_directories,
+    search_symlinks_in_directory,
+)
+from ctgrzr.src.utils import PathKind
 
 set_logging_level(logging.CRITICAL)
 
+# Generous, so only heavy module imports on the startup path trip it
+CLI_IMPORT_TIME_BUDGET = 0.5
+
+python_operation_calls = []
+
+
+def record_python_operation(paths):
+    python_operation_calls.append(paths)
+
 
 class CtgrzrTest(unittest.TestCase):
 
@@ -57,6 +98,9 @@ class CtgrzrTest(unittest.TestCase):
             run_command(f'rm "{self.config_path}"')
         if self.template_config_path.exists():
             run_command(f'rm "{self.template_config_path}"')
+        for config_path in [self.config_path, self.template_config_path]:
+            get_config_cache_path(config_path).unlink(missing_ok=True)
+            get_config_journal_path(config_path).unlink(missing_ok=True)
         if self.side_effect_file.exists():
             run_command(f'rm "{self.side_effect_file}"')
         # if self.operation_file.exists():
@@ -110,7 +154,7 @@ class CtgrzrTest(unittest.TestCase):
         self.assertEqual(cli(args_add_symlink), 0)
         config = load_config(self.config_path)
         self.assertDictEqual(
-            config,
+            config.to_dict(),
             {
                 self.category1: [self.file2, self.file1_symlink],
                 self.category2: [self.file3],
@@ -173,7 +217,7 @@ class CtgrzrTest(unittest.TestCase):
         self.assertEqual(cli(args_autoadd_with_symlink), 0)
         config = load_config(self.config_path)
         self.assertDictEqual(
-            config,
+            config.to_dict(),
             {
                 self.category1: [self.file1, self.file2],
                 self.category2: [self.file2, self.file1_symlink],
@@ -182,13 +226,20 @@ class CtgrzrTest(unittest.TestCase):
 
         run_command(f"rm {self.file1_symlink}", check=True)
         run_command(f"rm {self.config_path}", check=True)
+        template_cache_path = get_config_cache_path(self.template_config_path)
+        template_cache_path.unlink(missing_ok=True)
         args_autoadd = self.arg_parser.parse_args(
             ["autoadd", str(self.template_config_path)]
         )
         self.assertEqual(cli(args_autoadd), 0)
-        config = load_config(self.config_path)
+        self.assertFalse(template_cache_path.exists())
+        config_cache_path = get_config_cache_path(self.config_path)
+        config_cache_path.unlink(missing_ok=True)
+        with mock.patch("os.access", return_value=False):
+            config = load_config(self.config_path)
+        self.assertFalse(config_cache_path.exists())
         self.assertDictEqual(
-            config,
+            config.to_dict(),
             {self.category1: [self.file1, self.file2], self.category2: [self.file2]},
         )
 
@@ -203,6 +254,63 @@ class CtgrzrTest(unittest.TestCase):
         )
         self.assertSetEqual(expected_symlinks, actual_symlinks)
 
+        symlinked_directory = self.root_path / "example-symlink"
+        symlinked_directory.symlink_to(subdir)
+        symlink_matches = list(
+            search_symlinks_in_directories(
+                [subdir, self.root_path, self.file1_symlink, self.file2], jobs=2
+            )
+        )
+        self.assertCountEqual(
+            [symlink_match.path for symlink_match in symlink_matches],
+            expected_symlinks | {symlinked_directory},
+        )
+        roots_by_symlink = {
+            symlink_match.path: symlink_match.roots for symlink_match in symlink_matches
+        }
+        self.assertListEqual(
+            roots_by_symlink[self.file1_symlink], [self.root_path, self.file1_symlink]
+        )
+        self.assertListEqual(roots_by_symlink[nested_symlink], [self.root_path, subdir])
+
+        outside_symlink = subdir / "outside-symlink"
+        outside_symlink.symlink_to(self.side_effect_file)
+        symlink_matches = {
+            symlink_match.path: symlink_match
+            for symlink_match in search_symlinks_in_directories(
+                [self.root_path, subdir], one_file_system=True
+            )
+        }
+        self.assertTrue(symlink_matches[outside_symlink].is_target_outside)
+        self.assertFalse(symlink_matches[nested_symlink].is_target_outside)
+        self.assertFalse(symlink_matches[symlinked_directory].is_target_outside)
+
+        for options in [
+            dict(exclude=ExcludeMatcher(["examp?e", "node_modules"])),
+            dict(exclude=ExcludeMatcher([f"{self.root_path}/example"])),
+            dict(max_depth=1),
+        ]:
+            self.assertSetEqual(
+                set(
+                    symlink_match.path
+                    for symlink_match in search_symlinks_in_directories(
+                        [self.root_path], **options
+                    )
+                ),
+                {self.file1_symlink, symlinked_directory},
+            )
+
+        # Serial search streams matches, the rest of the tree isn't walked yet
+        symlink_matches = search_symlinks_in_directories([self.root_path])
+        self.assertIn(
+            next(symlink_matches).path, {self.file1_symlink, symlinked_directory}
+        )
+        late_symlink = subdir / "late-symlink"
+        late_symlink.symlink_to(self.file1)
+        self.assertIn(
+            late_symlink, [symlink_match.path for symlink_match in symlink_matches]
+        )
+
     def test_validate(self):
         args_add_path1 = self.arg_parser.parse_args(
             ["add", str(self.file1), self.category1]
@@ -218,10 +326,14 @@ class CtgrzrTest(unittest.TestCase):
         self.assertEqual(cli(args_add_path3), 0)
 
         args_validate = self.arg_parser.parse_args(["validate"])
+        args_validate_parallel = self.arg_parser.parse_args(["validate", "-j", "4"])
         self.assertEqual(cli(args_validate), 0)
+        self.assertEqual(cli(args_validate_parallel), 0)
         run_command(f'rm "{self.file1}"', check=True)
         with self.assertRaises(Exception):
             cli(args_validate)
+        with self.assertRaisesRegex(AppException, str(self.file1)):
+            cli(args_validate_parallel)
 
     def test_apply(self):
         args_add_path1 = self.arg_parser.parse_args(
@@ -245,6 +357,732 @@ class CtgrzrTest(unittest.TestCase):
             side_effect_file_contents = f.read()
         get_logger().info(side_effect_file_contents)
 
+    def test_apply_parallel(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category1, self.category2]
+        )
+        args_add_path3 = self.arg_parser.parse_args(
+            ["add", str(self.file3), self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+        self.assertEqual(cli(args_add_path3), 0)
+
+        args_apply = self.arg_parser.parse_args(
+            ["apply", "-j", "3", str(self.operation_file)]
+        )
+        self.assertEqual(cli(args_apply), 0)
+        with open(self.side_effect_file) as f:
+            side_effect_lines = sorted(f.read().splitlines())
+        self.assertListEqual(
+            side_effect_lines,
+            [
+                f"Category1 - {self.file1}",
+                f"Category1 - {self.file2}",
+                f"Category2 - {self.file2}",
+                f"Category2 - {self.file3}",
+            ],
+        )
+
+        failing_operation_file = self.operation_file.parent / "failing-operation.yaml"
+        with open(failing_operation_file, "w") as f:
+            f.write(
+                yaml.dump(
+                    {self.category1: 'test -e "{}"', self.category2: 'test ! -e "{}"'}
+                )
+            )
+        args_apply_strict = self.arg_parser.parse_args(
+            ["apply", "-s", "-j", "3", str(failing_operation_file)]
+        )
+        with self.assertRaises(AppException):
+            cli(args_apply_strict)
+
+    def test_apply_batched(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category1, self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+
+        batched_operation_file = self.operation_file.parent / "batched-operation.yaml"
+        with open(batched_operation_file, "w") as f:
+            f.write(
+                yaml.dump(
+                    {
+                        self.category1: "echo {}+ >> " + f'"{self.side_effect_file}"',
+                        self.category2: "echo {}+ >> " + f'"{self.side_effect_file}"',
+                    }
+                )
+            )
+        args_apply = self.arg_parser.parse_args(["apply", str(batched_operation_file)])
+        self.assertEqual(cli(args_apply), 0)
+        with open(self.side_effect_file) as f:
+            side_effect_lines = f.read().splitlines()
+        self.assertListEqual(
+            side_effect_lines, [f"{self.file1} {self.file2}", f"{self.file2}"]
+        )
+
+        operations = list(
+            expand_batch_operations(
+                self.category1,
+                [self.file1, self.file2, self.file3],
+                "echo {}+",
+                len("echo ") + len(str(self.file1)) * 2 + 2,
+            )
+        )
+        self.assertListEqual(
+            [operation.paths for operation in operations],
+            [[self.file1, self.file2], [self.file3]],
+        )
+
+    def test_apply_incremental(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+
+        args_apply = self.arg_parser.parse_args(
+            ["apply", "--incremental", str(self.operation_file)]
+        )
+        try:
+            self.assertEqual(cli(args_apply), 0)
+            self.assertEqual(cli(args_apply), 0)
+            run_command(f'echo changed > "{self.file2}"', check=True)
+            self.assertEqual(cli(args_apply), 0)
+            with open(self.side_effect_file) as f:
+                side_effect_lines = f.read().splitlines()
+            self.assertListEqual(
+                side_effect_lines,
+                [
+                    f"Category1 - {self.file1}",
+                    f"Category2 - {self.file2}",
+                    f"Category2 - {self.file2}",
+                ],
+            )
+        finally:
+            get_apply_state_path(self.config_path).unlink(missing_ok=True)
+
+    def test_apply_plan_resume(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category1, self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+
+        plan_path = self.config_path.parent / "apply.plan"
+        journal_path = get_apply_journal_path(plan_path)
+        args_plan = self.arg_parser.parse_args(
+            ["apply", "--plan", str(plan_path), str(self.operation_file)]
+        )
+        args_resume = self.arg_parser.parse_args(["apply", "--resume", str(plan_path)])
+        try:
+            self.assertEqual(cli(args_plan), 0)
+            self.assertFalse(self.side_effect_file.exists())
+            # Operation 1 was being recorded when the run crashed
+            with open(journal_path, "w") as f:
+                f.write("0\n1")
+            self.assertEqual(cli(args_resume), 0)
+            self.assertEqual(cli(args_resume), 0)
+            with open(self.side_effect_file) as f:
+                side_effect_lines = f.read().splitlines()
+            self.assertListEqual(
+                side_effect_lines,
+                [f"Category1 - {self.file2}", f"Category2 - {self.file2}"],
+            )
+            with open(journal_path) as f:
+                self.assertEqual(f.read(), "0\n1\n2\n")
+            with open(journal_path, "a") as f:
+                f.write("garbage\n")
+            with self.assertRaisesRegex(AppException, "corrupted on line 4"):
+                cli(args_resume)
+        finally:
+            plan_path.unlink(missing_ok=True)
+            journal_path.unlink(missing_ok=True)
+
+    def test_apply_coprocess(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+        args_apply = self.arg_parser.parse_args(
+            ["apply", "--executor", "coprocess", "-j", "2", str(self.operation_file)]
+        )
+        self.assertEqual(cli(args_apply), 0)
+        with open(self.side_effect_file) as f:
+            side_effect_lines = sorted(f.read().splitlines())
+        self.assertListEqual(
+            side_effect_lines,
+            [f"Category1 - {self.file1}", f"Category2 - {self.file2}"],
+        )
+
+        with ShellWorkerPool(1) as shell_workers:
+            self.assertEqual(shell_workers.run("printf a; exit 3"), (3, "a"))
+            self.assertEqual(shell_workers.run("echo b # comment"), (0, "b\n"))
+            self.assertNotEqual(shell_workers.run("echo 'unterminated")[0], 0)
+            self.assertEqual(shell_workers.run("echo c"), (0, "c\n"))
+            # Same as subprocess executor, undecodable bytes reach the shell
+            undecodable_name = os.fsdecode(b"caf\xe9")
+            self.assertEqual(
+                shell_workers.run(f"echo {undecodable_name}"), (0, "caf\ufffd\n")
+            )
+
+    def test_apply_python_operation(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category1, self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+
+        python_operation_file = self.operation_file.parent / "python-operation.yaml"
+        with open(python_operation_file, "w") as f:
+            f.write(
+                yaml.dump(
+                    {
+                        self.category1: {
+                            "python": f"{__name__}:record_python_operation",
+                            "batch": True,
+                        },
+                        self.category2: 'echo "Category2 - {}" >> '
+                        + f'"{self.side_effect_file}"',
+                    }
+                )
+            )
+        python_operation_calls.clear()
+        args_apply = self.arg_parser.parse_args(["apply", str(python_operation_file)])
+        self.assertEqual(cli(args_apply), 0)
+        self.assertListEqual(python_operation_calls, [[self.file1, self.file2]])
+        with open(self.side_effect_file) as f:
+            self.assertEqual(f.read(), f"Category2 - {self.file2}\n")
+
+    def test_config_index(self):
+        config = CtgrzrConfig()
+        add_path(config, self.file1, [self.category1, self.category2], False)
+        add_path(config, self.file2, [self.category1], False)
+        add_path(config, self.file1, [self.category1], True)
+        self.assertDictEqual(
+            config.to_dict(),
+            {
+                self.category1: [self.file2, self.file1],
+                self.category2: [self.file1],
+            },
+        )
+        self.assertListEqual(
+            config.get_categories(self.file1), [self.category2, self.category1]
+        )
+        remove_path(config, self.file1, [self.category1, self.category2], False)
+        self.assertFalse(config.has_path(self.file1))
+        self.assertSetEqual(set(config.get_paths()), {self.file2})
+
+    def test_config_cache(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        cache_path = get_config_cache_path(self.config_path)
+        self.assertTrue(cache_path.exists())
+        self.assertDictEqual(
+            load_config(self.config_path).to_dict(), {self.category1: [self.file1]}
+        )
+
+        with open(self.config_path, "w") as f:
+            f.write(yaml.dump({self.category2: [str(self.file2), str(self.file3)]}))
+        self.assertDictEqual(
+            load_config(self.config_path).to_dict(),
+            {self.category2: [self.file2, self.file3]},
+        )
+        with open(cache_path, "wb") as f:
+            f.write(b"corrupted")
+        self.assertDictEqual(
+            load_config(self.config_path).to_dict(),
+            {self.category2: [self.file2, self.file3]},
+        )
+
+    def test_config_journal(self):
+        args_add_path1 = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1]
+        )
+        args_add_path2 = self.arg_parser.parse_args(
+            ["add", str(self.file2), self.category1, self.category2]
+        )
+        args_add_path1_force = self.arg_parser.parse_args(
+            ["add", "-f", str(self.file1), self.category1]
+        )
+        args_remove_path2 = self.arg_parser.parse_args(
+            ["remove", str(self.file2), self.category2]
+        )
+        self.assertEqual(cli(args_add_path1), 0)
+        self.assertEqual(cli(args_add_path2), 0)
+        self.assertEqual(cli(args_add_path1_force), 0)
+        self.assertEqual(cli(args_remove_path2), 0)
+        journal_path = get_config_journal_path(self.config_path)
+        self.assertTrue(journal_path.exists())
+        expected_config = {self.category1: [self.file2, self.file1], self.category2: []}
+        self.assertDictEqual(load_config(self.config_path).to_dict(), expected_config)
+
+        self.assertEqual(cli(self.arg_parser.parse_args(["compact"])), 0)
+        self.assertFalse(journal_path.exists())
+        with open(self.config_path) as f:
+            self.assertDictEqual(
+                yaml.safe_load(f),
+                {
+                    category: [str(path) for path in paths]
+                    for category, paths in expected_config.items()
+                },
+            )
+        self.assertDictEqual(load_config(self.config_path).to_dict(), expected_config)
+
+    def test_add_remove_stdin(self):
+        args_add_stdin = self.arg_parser.parse_args(
+            ["add", "-0", "--stdin", self.category1, self.category2]
+        )
+        paths = [self.file1, self.not_exists, self.file2, self.file1_symlink]
+        stdin = io.TextIOWrapper(
+            io.BytesIO(b"\0".join(bytes(path) for path in paths) + b"\0")
+        )
+        with mock.patch.object(sys, "stdin", stdin):
+            self.assertEqual(cli(args_add_stdin), 1)
+        self.assertDictEqual(
+            load_config(self.config_path).to_dict(),
+            {
+                self.category1: [self.file1, self.file2],
+                self.category2: [self.file1, self.file2],
+            },
+        )
+
+        args_remove_stdin = self.arg_parser.parse_args(
+            ["remove", "--stdin", self.category2]
+        )
+        stdin = io.TextIOWrapper(io.BytesIO(f"{self.file1}\n{self.file2}".encode()))
+        with mock.patch.object(sys, "stdin", stdin):
+            self.assertEqual(cli(args_remove_stdin), 0)
+        self.assertDictEqual(
+            load_config(self.config_path).to_dict(),
+            {self.category1: [self.file1, self.file2], self.category2: []},
+        )
+
+        # Missing category is reported once, before any path is read
+        args_remove_stdin = self.arg_parser.parse_args(
+            ["remove", "--stdin", self.category1, "not-exists"]
+        )
+        stdin = io.TextIOWrapper(io.BytesIO(f"{self.file1}\n{self.file2}".encode()))
+        with mock.patch.object(sys, "stdin", stdin):
+            with self.assertRaisesRegex(AppException, "^Categories not-exists don't"):
+                cli(args_remove_stdin)
+            self.assertEqual(stdin.buffer.tell(), 0)
+
+        with mock.patch("sys.stderr", new_callable=io.StringIO):
+            with self.assertRaises(SystemExit):
+                self.arg_parser.parse_args(
+                    ["add", str(self.file1), "--stdin", self.category1]
+                )
+
+    def test_search_symlinks_cache(self):
+        subdir = self.root_path / "example"
+        subdir.mkdir(parents=True)
+        nested_symlink = subdir / "file2-symlink"
+        nested_symlink.symlink_to(self.file2)
+
+        def search_symlinks(scan_cache):
+            # Pretend the scan happens later, so fresh directories are cacheable
+            scan_cache.started_ns += 10 * SCAN_CACHE_RACY_INTERVAL_NS
+            return set(
+                symlink_match.path
+                for symlink_match in search_symlinks_in_directories(
+                    [self.root_path], scan_cache=scan_cache
+                )
+            )
+
+        scan_cache = ScanCache()
+        expected_symlinks = {self.file1_symlink, nested_symlink}
+        self.assertSetEqual(search_symlinks(scan_cache), expected_symlinks)
+        self.assertEqual(scan_cache.hits, 0)
+        scan_cache = ScanCache(scan_cache.visited_directories)
+        self.assertSetEqual(search_symlinks(scan_cache), expected_symlinks)
+        self.assertEqual(scan_cache.hits, 2)
+
+        another_symlink = subdir / "file3-symlink"
+        another_symlink.symlink_to(self.file3)
+        scan_cache = ScanCache(scan_cache.visited_directories)
+        self.assertSetEqual(
+            search_symlinks(scan_cache), expected_symlinks | {another_symlink}
+        )
+        self.assertEqual(scan_cache.hits, 1)
+
+    def test_fs_walk_stack(self):
+        subdir = self.root_path / "example"
+        subdir.mkdir(parents=True)
+        nested_file = subdir / "nested-file"
+        run_command(f'echo d > "{nested_file}"', check=True)
+        ctx = dict(stack=[prefetch_paths([subdir, self.file1])], current_depth=0)
+        entry = get_next_path(ctx)
+        self.assertEqual(entry.path, subdir)
+        self.assertEqual(entry.kind, PathKind.DIRECTORY)
+        self.assertTrue(should_process_path(entry.path, False, entry=entry))
+        step_into(ctx, subdir)
+        self.assertEqual(ctx["current_depth"], 1)
+        entry = get_next_path(ctx)
+        self.assertEqual(entry.path, nested_file)
+        self.assertEqual(entry.kind, PathKind.FILE)
+        self.assertEqual(get_next_path(ctx).path, self.file1)
+        self.assertEqual(ctx["current_depth"], 0)
+        self.assertIsNone(get_next_path(ctx))
+
+        ctx = dict(stack=[prefetch_paths([self.root_path])], current_depth=0)
+        self.assertEqual(get_next_path(ctx).path, self.root_path)
+        step_into(ctx, self.root_path)
+        self.assertIn(get_next_path(ctx).path, set(self.root_path.iterdir()))
+        step_out(ctx)
+        self.assertEqual(ctx["current_depth"], 0)
+        self.assertIsNone(get_next_path(ctx))
+
+    def test_classify(self):
+        build_path = self.root_path / "project" / "build"
+        build_path.mkdir(parents=True)
+        source_path = self.root_path / "project" / "main.py"
+        run_command(f'echo "print()" > "{source_path}"', check=True)
+        run_command(f'echo "print()" > "{build_path / "generated.py"}"', check=True)
+        rules_path = self.config_path.parent / "rules.yaml"
+        with open(rules_path, "w") as f:
+            f.write(
+                yaml.dump(
+                    [
+                        {"regex": "/build$", "categories": [self.category2]},
+                        {"glob": "*.py", "type": "directory", "categories": ["x"]},
+                        {"glob": "*.py", "categories": [self.category1]},
+                        {"glob": "file*", "min_size": 3, "categories": ["x"]},
+                        {"max_size": 2, "categories": [self.category2]},
+                    ]
+                )
+            )
+        args_classify = self.arg_parser.parse_args(
+            ["classify", str(rules_path), str(self.root_path), "-e", "file3"]
+        )
+        try:
+            self.assertEqual(cli(args_classify), 0)
+            config_stat = self.config_path.stat()
+            # Rerun over classified tree is no-op
+            self.assertEqual(cli(args_classify), 0)
+            self.assertEqual(self.config_path.stat(), config_stat)
+            self.assertFalse(get_config_journal_path(self.config_path).exists())
+        finally:
+            rules_path.unlink()
+        config = load_config(self.config_path)
+        # Walk follows directory listing order
+        self.assertDictEqual(
+            {category: set(paths) for category, paths in config.items()},
+            {
+                self.category2: {
+                    build_path,
+                    self.file1,
+                    self.file1_symlink,
+                    self.file2,
+                },
+                self.category1: {source_path},
+            },
+        )
+
+    def test_cli_import_is_lazy(self):
+        # Fresh interpreter, modules imported by other tests don't count
+        code = "\n".join(
+            [
+                "import sys, time",
+                "started = time.perf_counter()",
+                "import ctgrzr.src.cli",
+                "print(time.perf_counter() - started)",
+                "print(' '.join(sys.modules))",
+            ]
+        )
+        completed_process = subprocess.run(
+            [sys.executable, "-c", code],
+            stdout=subprocess.PIPE,
+            check=True,
+            cwd=Path(__file__).resolve().parents[2],
+        )
+        import_time, modules = completed_process.stdout.decode().splitlines()
+        top_level_modules = {module.split(".")[0] for module in modules.split()}
+        for module in ["InquirerPy", "prompt_toolkit", "yaml"]:
+            self.assertNotIn(module, top_level_modules)
+        self.assertLess(float(import_time), CLI_IMPORT_TIME_BUDGET)
+
+    def test_json_logging(self):
+        log_path = self.root_path / "log.jsonl"
+        disable_json_logging = enable_json_logging(log_path)
+        try:
+            add_path(CtgrzrConfig(), self.file1, [self.category1], False)
+            get_logger().debug("Not logged")
+            get_logger().info('Checking for symlinks in "%s"', self.root_path)
+        finally:
+            disable_json_logging()
+        self.assertFalse(get_logger().isEnabledFor(logging.INFO))
+        with open(log_path) as f:
+            entries = [json.loads(line) for line in f]
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(
+            entries[1]["message"], f'Checking for symlinks in "{self.root_path}"'
+        )
+        self.assertEqual(entries[0]["level"], "INFO")
+        self.assertEqual(
+            entries[0]["message"],
+            f'Adding path "{self.file1}" to config - categories -  {self.category1}',
+        )
+
+    def test_timings(self):
+        timings_path = self.root_path / "timings.json"
+        for arguments in [
+            ["add", str(self.file1), self.category1],
+            ["add", str(self.file2), self.category1, self.category2],
+            ["apply", str(self.operation_file)],
+        ]:
+            args = self.arg_parser.parse_args(
+                ["--timings", str(timings_path)] + arguments
+            )
+            self.assertEqual(cli(args), 0)
+            # Without cache the config is parsed again
+            get_config_cache_path(self.config_path).unlink()
+        with open(timings_path) as f:
+            timings = json.load(f)
+        self.assertLessEqual(
+            {"load", "parse", "deserialize", "command"}, set(timings["phases"])
+        )
+        self.assertEqual(timings["phases"]["command"]["count"], 1)
+        self.assertEqual(
+            {
+                category: totals["operations"]
+                for category, totals in timings["categories"].items()
+            },
+            {self.category1: 2, self.category2: 1},
+        )
+
+    def test_progress(self):
+        progress_path = self.root_path / "progress.json"
+        args_add_path = self.arg_parser.parse_args(
+            ["add", str(self.file1), self.category1, self.category2]
+        )
+        self.assertEqual(cli(args_add_path), 0)
+        args_apply = self.arg_parser.parse_args(
+            ["--progress-file", str(progress_path), "apply", str(self.operation_file)]
+        )
+        self.assertEqual(cli(args_apply), 0)
+        with open(progress_path) as f:
+            status = json.load(f)
+        self.assertEqual(status["command"], "apply")
+        self.assertEqual((status["done"], status["total"]), (2, 2))
+        self.assertEqual(status["failures"], 0)
+        self.assertTrue(status["finished"])
+
+        stream = io.StringIO()
+        progress = ProgressReporter(should_render=True, stream=stream)
+        progress.start("validate", 2)
+        progress.update(failed=True)
+        progress.update()
+        progress.finish()
+        self.assertRegex(stream.getvalue(), r"^validate: 2/2 \(100%\) .* 1 failure")
+
+        # Single root still reports every scanned directory & found symlink
+        walk_path = self.root_path / "walk"
+        (walk_path / "a" / "b").mkdir(parents=True)
+        (walk_path / "file1-symlink").symlink_to(self.file1)
+        (walk_path / "a" / "b" / "file2-symlink").symlink_to(self.file2)
+        for jobs in [1, 2]:
+            progress = ProgressReporter(status_path=progress_path)
+            progress.start("search-symlinks")
+            list(
+                search_symlinks_in_directories(
+                    [walk_path], jobs=jobs, progress=progress
+                )
+            )
+            progress.finish()
+            with open(progress_path) as f:
+                status = json.load(f)
+            self.assertEqual((status["done"], status["total"]), (3, None))
+            self.assertEqual(status["found"], 2)
+
+    def test_apply_records(self):
+        records_path = self.root_path / "records.jsonl"
+        for arguments in [
+            ["add", str(self.file1), self.category1],
+            ["add", str(self.file2), self.category1, self.category2],
+        ]:
+            self.assertEqual(cli(self.arg_parser.parse_args(arguments)), 0)
+        args_apply = self.arg_parser.parse_args(
+            ["apply", "--records", str(records_path), str(self.operation_file)]
+        )
+        with mock.patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            self.assertEqual(cli(args_apply), 0)
+        with open(records_path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(
+            [(record["category"], record["paths"]) for record in records],
+            [
+                (self.category1, [str(self.file1)]),
+                (self.category1, [str(self.file2)]),
+                (self.category2, [str(self.file2)]),
+            ],
+        )
+        for record in records:
+            self.assertEqual(record["returncode"], 0)
+            self.assertGreater(record["duration"], 0)
+            self.assertGreater(record["max_rss_kb"], 0)
+        summary = stderr.getvalue()
+        self.assertIn(f'* Category "{self.category2}"', summary)
+        self.assertIn(str(self.file2), summary)
+
+    def test_collapse_roots(self):
+        outer_path = self.root_path / "outer"
+        real_path = self.root_path / "real"
+        (real_path / "nested").mkdir(parents=True)
+        (outer_path / "sibling").mkdir(parents=True)
+        link_path = outer_path / "link"
+        link_path.symlink_to(real_path)
+        # Root behind the symlink is kept, later siblings are still covered
+        behind_link_path = link_path / "nested"
+        sibling_path = outer_path / "sibling"
+        self.assertListEqual(
+            collapse_roots([sibling_path, behind_link_path, outer_path]),
+            [outer_path, behind_link_path],
+        )
+        # Symlink root isn't walked, root nested in it has to be searched
+        self.assertListEqual(
+            collapse_roots([behind_link_path, link_path], {link_path}),
+            [link_path, behind_link_path],
+        )
+        self.assertListEqual(
+            collapse_roots([link_path, outer_path, behind_link_path], {link_path}),
+            [outer_path, behind_link_path],
+        )
+
+        # Roots the outer walk never lists are searched on their own
+        excluded_path = outer_path / "node_modules" / "pkg"
+        deep_path = outer_path / "sibling" / "deep"
+        excluded_path.mkdir(parents=True)
+        deep_path.mkdir()
+        (excluded_path / "link1").symlink_to(self.file1)
+        (deep_path / "link2").symlink_to(self.file2)
+        roots = [outer_path, excluded_path, deep_path]
+        for options, expected_symlinks in [
+            (
+                dict(exclude=ExcludeMatcher(["node_modules"])),
+                {link_path, excluded_path / "link1", deep_path / "link2"},
+            ),
+            (
+                dict(max_depth=1),
+                {link_path, excluded_path / "link1", deep_path / "link2"},
+            ),
+            (
+                dict(max_depth=3),
+                {link_path, excluded_path / "link1", deep_path / "link2"},
+            ),
+        ]:
+            self.assertSetEqual(
+                set(
+                    symlink_match.path
+                    for symlink_match in search_symlinks_in_directories(
+                        roots, **options
+                    )
+                ),
+                expected_symlinks,
+            )
+        self.assertListEqual(collapse_roots(roots, max_depth=3), [outer_path])
+        self.assertListEqual(
+            collapse_roots(roots, max_depth=2), [outer_path, excluded_path, deep_path]
+        )
+
+        # Walk with -x doesn't cross into other filesystem, even to nested root
+        mounted_path = Path("/dev/shm")
+        if mounted_path.is_dir() and (
+            os.lstat(mounted_path).st_dev != os.lstat(mounted_path.parent).st_dev
+        ):
+            self.assertListEqual(
+                collapse_roots([mounted_path.parent, mounted_path]),
+                [mounted_path.parent],
+            )
+            self.assertListEqual(
+                collapse_roots(
+                    [mounted_path.parent, mounted_path], one_file_system=True
+                ),
+                [mounted_path.parent, mounted_path],
+            )
+
+    def test_config_journal_truncated_entry(self):
+        for path in [self.file1, self.file2]:
+            args_add_path = self.arg_parser.parse_args(
+                ["add", str(path), self.category1]
+            )
+            self.assertEqual(cli(args_add_path), 0)
+        journal_path = get_config_journal_path(self.config_path)
+        with open(journal_path, "a") as f:
+            f.write('["add", "category1", "/ctgr')
+        args_add_path3 = self.arg_parser.parse_args(
+            ["add", str(self.file3), self.category1]
+        )
+        self.assertEqual(cli(args_add_path3), 0)
+        config = load_config(self.config_path)
+        self.assertListEqual(
+            list(config[self.category1]), [self.file1, self.file2, self.file3]
+        )
+
+    def test_classify_rules_regex(self):
+        rules_path = self.root_path / "rules.yaml"
+
+        def load_rules(regexes):
+            with open(rules_path, "w") as f:
+                f.write(
+                    yaml.dump(
+                        [
+                            {"regex": regex, "categories": [self.category1]}
+                            for regex in regexes
+                        ]
+                    )
+                )
+            return load_classify_rules(rules_path)
+
+        rules = load_rules(["/nomatch$", "(?i)readme$"])
+        self.assertEqual(rules.match("/tmp/README", PathKind.FILE).index, 1)
+        self.assertIsNone(rules.match("/tmp/readme.txt", PathKind.FILE))
+        # Group references keep their meaning, the rules aren't combined
+        rules = load_rules(["/nomatch$", "/(x)\\1$", "/(?P<y>y)(?P=y)$", "/z$"])
+        self.assertEqual(rules.match("/tmp/xx", PathKind.FILE).index, 1)
+        self.assertEqual(rules.match("/tmp/yy", PathKind.FILE).index, 2)
+        self.assertEqual(rules.match("/tmp/z", PathKind.FILE).index, 3)
+        self.assertIsNone(rules.match("/tmp/x1", PathKind.FILE))
+
+    def test_config_undecodable_path(self):
+        undecodable_path = self.root_path / os.fsdecode(b"caf\xe9")
+        undecodable_path.touch()
+        args_add_path = self.arg_parser.parse_args(
+            ["add", str(undecodable_path), self.category1]
+        )
+        self.assertEqual(cli(args_add_path), 0)
+        self.assertEqual(cli(self.arg_parser.parse_args(["compact"])), 0)
+        get_config_cache_path(self.config_path).unlink()
+        config = load_config(self.config_path)
+        self.assertListEqual(list(config[self.category1]), [undecodable_path])
+
+    def test_run_command_invalid_utf8(self):
+        returncode, output = run_command("printf 'a\\377b'")
+        self.assertEqual(returncode, 0)
+        self.assertEqual(output, "a\ufffdb")
+
 
 if __name__ == "__main__":
     unittest.main()